@@ -0,0 +1,46 @@
+"""Throughput of MainHTTPHandler over persistent connection"""
+import http.client
+import json
+import threading
+
+from benchmarks.bench_scoring import PROFILE, INTERESTS, method_request
+from benchmarks.harness import benchmark, MemoryStore
+from scoring_api import api
+
+
+def http_benchmark(request):
+    handler_store = api.MainHTTPHandler.store
+    api.MainHTTPHandler.store = MemoryStore(INTERESTS)
+    server = api.ThreadPoolHTTPServer(('localhost', 0), api.MainHTTPHandler,
+                                      workers=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    conn = http.client.HTTPConnection(*server.server_address)
+    payload = json.dumps(request["body"]).encode('UTF-8')
+    max_requests = api.MainHTTPHandler.max_requests
+    api.MainHTTPHandler.max_requests = 0
+
+    def post():
+        conn.request('POST', '/method/', payload)
+        conn.getresponse().read()
+    try:
+        yield post
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        api.MainHTTPHandler.store = handler_store
+        api.MainHTTPHandler.max_requests = max_requests
+
+
+@benchmark("http.online_score")
+def bench_http_online_score():
+    yield from http_benchmark(method_request("h&f", "online_score", PROFILE))
+
+
+@benchmark("http.clients_interests_100")
+def bench_http_clients_interests():
+    yield from http_benchmark(
+        method_request("h&f", "clients_interests",
+                       {"client_ids": list(range(100))}))
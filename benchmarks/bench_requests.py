@@ -0,0 +1,67 @@
+"""Request validation, validators and auth"""
+from benchmarks.harness import benchmark
+from scoring_api import api, validators
+
+METHOD_REQUEST = {"account": "horns&hoofs", "login": "h&f",
+                  "method": "online_score", "token": "token",
+                  "arguments": {}}
+ONLINE_SCORE_REQUEST = {"phone": "79175002040", "email": "a@otus.ru",
+                        "gender": 1, "birthday": "01.01.2000",
+                        "first_name": "a", "last_name": "b"}
+CLIENTS_INTERESTS_REQUEST = {"client_ids": list(range(100)),
+                             "date": "20.07.2017"}
+
+
+def validate(cls, request):
+    def run():
+        cls(request).validate()
+    return run
+
+
+@benchmark("validate.method_request")
+def bench_method_request():
+    return validate(api.MethodRequest, METHOD_REQUEST)
+
+
+@benchmark("validate.online_score_request")
+def bench_online_score_request():
+    return validate(api.OnlineScoreRequest, ONLINE_SCORE_REQUEST)
+
+
+@benchmark("validate.clients_interests_request")
+def bench_clients_interests_request():
+    return validate(api.ClientsInterestsRequest, CLIENTS_INTERESTS_REQUEST)
+
+
+VALIDATORS = {
+    "has_length": (validators.has_length(11), "79175002040"),
+    "starts_with": (validators.starts_with(7), "79175002040"),
+    "check_if_email": (validators.check_if_email, "a@otus.ru"),
+    "is_date": (validators.is_date('%d.%m.%Y'), "01.01.2000"),
+    "is_age_le": (validators.is_age_le(70, '%d.%m.%Y'), "01.01.2000"),
+    "int_in_range": (validators.int_in_range([0, 1, 2]), 2),
+    "check_type": (validators.check_type(str), "a"),
+    "item_has_type": (validators.item_has_type(int), list(range(100))),
+}
+
+
+def register_validator(name, validator, val):
+    @benchmark("validator." + name)
+    def bench():
+        return lambda: validator(val)
+
+
+for name, (validator, val) in VALIDATORS.items():
+    register_validator(name, validator, val)
+
+
+@benchmark("auth.digestize")
+def bench_digestize():
+    request = api.MethodRequest(METHOD_REQUEST)
+    return lambda: api.digestize(request)
+
+
+@benchmark("auth.digestize_admin")
+def bench_digestize_admin():
+    request = api.MethodRequest(dict(METHOD_REQUEST, login=api.ADMIN_LOGIN))
+    return lambda: api.digestize(request)
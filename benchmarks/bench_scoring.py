@@ -0,0 +1,98 @@
+"""Scoring functions and method_handler end to end"""
+import json
+
+from benchmarks.harness import benchmark, MemoryStore
+from scoring_api import api, interests, scoring
+
+PROFILE = dict(phone="79175002040", email="a@otus.ru", birthday="01.01.2000",
+               gender=1, first_name="a", last_name="b")
+INTERESTS = {"i:%s" % cid: '["cars", "pets", "travel"]' for cid in range(100)}
+
+
+@benchmark("scoring.get_score_cached")
+def bench_get_score_cached():
+    store = MemoryStore()
+    scoring.get_score(store, **PROFILE)
+    return lambda: scoring.get_score(store, **PROFILE)
+
+
+@benchmark("scoring.get_score_miss")
+def bench_get_score_miss():
+    class NoCache(object):
+        def cache_get(self, key):
+            return None
+
+        def cache_set(self, key, val, sec):
+            pass
+    store = NoCache()
+    return lambda: scoring.get_score(store, **PROFILE)
+
+
+RECORDS = [dict(PROFILE, phone="7%010d" % i) for i in range(1000)]
+
+
+@benchmark("scoring.get_scores_miss_1000")
+def bench_get_scores_miss():
+    class NoCache(object):
+        def cache_get_many(self, keys):
+            return [None] * len(keys)
+
+        def cache_set_many(self, items, sec):
+            pass
+    store = NoCache()
+    return lambda: scoring.get_scores(store, RECORDS)
+
+
+@benchmark("scoring.get_interests")
+def bench_get_interests():
+    store = MemoryStore(INTERESTS)
+    return lambda: scoring.get_interests(store, 1)
+
+
+@benchmark("scoring.get_interests_many_100")
+def bench_get_interests_many():
+    store = MemoryStore(INTERESTS)
+    cids = list(range(100))
+    return lambda: scoring.get_interests_many(store, cids)
+
+
+@benchmark("scoring.get_interests_many_100_compact")
+def bench_get_interests_many_compact():
+    store = MemoryStore({key: interests.encode(json.loads(value))
+                         for key, value in INTERESTS.items()})
+    cids = list(range(100))
+    return lambda: scoring.get_interests_many(store, cids)
+
+
+def method_request(login, method, arguments):
+    body = {"account": "horns&hoofs", "login": login, "method": method,
+            "arguments": arguments}
+    body["token"] = api.digestize(api.MethodRequest(body))
+    return {"body": body, "headers": {}}
+
+
+def handle(store, request):
+    def run():
+        api.method_handler(request, {}, store)
+    return run
+
+
+@benchmark("handler.online_score")
+def bench_handler_online_score():
+    return handle(MemoryStore(),
+                  method_request("h&f", "online_score", PROFILE))
+
+
+@benchmark("handler.clients_interests_100")
+def bench_handler_clients_interests():
+    return handle(MemoryStore(INTERESTS),
+                  method_request("h&f", "clients_interests",
+                                 {"client_ids": list(range(100))}))
+
+
+@benchmark("handler.batch_online_score_100")
+def bench_handler_batch():
+    items = [method_request("h&f", "online_score",
+                            dict(PROFILE, first_name=str(i)))["body"]
+             for i in range(100)]
+    return handle(MemoryStore(), {"body": items, "headers": {}})
@@ -0,0 +1,45 @@
+"""RedisStore over in-process fakeredis. Benchmarks are skipped when
+fakeredis is not installed"""
+from benchmarks.harness import benchmark, make_redis_store
+
+KEYS = ["i:%s" % cid for cid in range(100)]
+DATA = {key: '["cars", "pets", "travel"]' for key in KEYS}
+
+
+def redis_benchmark(name):
+    def register(setup):
+        if make_redis_store() is not None:
+            benchmark(name)(setup)
+        return setup
+    return register
+
+
+@redis_benchmark("store.get")
+def bench_get():
+    store = make_redis_store(DATA)
+    return lambda: store.get(KEYS[0])
+
+
+@redis_benchmark("store.get_many_100")
+def bench_get_many():
+    store = make_redis_store(DATA)
+    return lambda: store.get_many(KEYS)
+
+
+@redis_benchmark("store.cache_get")
+def bench_cache_get():
+    store = make_redis_store(DATA)
+    return lambda: store.cache_get(KEYS[0])
+
+
+@redis_benchmark("store.cache_set")
+def bench_cache_set():
+    store = make_redis_store()
+    return lambda: store.cache_set("uid:1", 3.0, 3600)
+
+
+@redis_benchmark("store.cache_set_many_100")
+def bench_cache_set_many():
+    store = make_redis_store()
+    items = {"uid:%s" % i: 3.0 for i in range(100)}
+    return lambda: store.cache_set_many(items, 3600)
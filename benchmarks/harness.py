@@ -0,0 +1,75 @@
+"""Benchmark registry and timing. Benchmark is a function preparing the
+callable to time. It either returns the callable or yields it once, code
+after yield runs as teardown"""
+import gc
+import inspect
+import time
+import timeit
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def measure(setup, repeat=5, min_time=0.2):
+    """Returns dict with best time per call in seconds over `repeat` runs,
+    each run lasting at least min_time"""
+    if inspect.isgeneratorfunction(setup):
+        gen = setup()
+        func = next(gen)
+    else:
+        gen, func = None, setup()
+    try:
+        timer = timeit.Timer(func, timer=time.perf_counter)
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+        gc.collect()
+        best = min(timer.repeat(repeat, number)) / number
+    finally:
+        if gen is not None:
+            gen.close()
+    return {"per_call_us": best * 1e6, "calls_per_sec": 1 / best,
+            "number": number, "repeat": repeat}
+
+
+class MemoryStore(object):
+    """Dict based store with the Store interface, ttl is ignored"""
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.data.get(key)
+
+    def cache_set(self, key, val, sec):
+        self.data[key] = val
+
+    def cache_get_many(self, keys):
+        return self.get_many(keys)
+
+    def cache_set_many(self, items, sec):
+        self.data.update(items)
+
+
+def make_redis_store(data=None):
+    """RedisStore on in-process fakeredis, None if it is not installed"""
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    from scoring_api import store
+    client = fakeredis.FakeStrictRedis()
+    for key, val in (data or {}).items():
+        client.set(key, val)
+    return store.RedisStore(client_builder=lambda: client)
@@ -0,0 +1,84 @@
+"""Runs benchmarks, writes results as json and compares them with baseline.
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run -c baseline.json --threshold 0.1
+
+Exit code is 1 when any benchmark is slower than baseline by more than
+threshold."""
+import datetime
+import json
+import platform
+import sys
+from optparse import OptionParser
+
+from benchmarks import (bench_requests, bench_scoring, bench_store,  # noqa
+                        bench_http)
+from benchmarks.harness import BENCHMARKS, measure
+from scoring_api import codec
+
+
+def run(names, repeat, min_time):
+    results = {}
+    for name in names:
+        results[name] = measure(BENCHMARKS[name], repeat, min_time)
+        print("%-40s %12.2f us %14.0f /s" % (
+            name, results[name]["per_call_us"],
+            results[name]["calls_per_sec"]), file=sys.stderr)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "codec": codec.BACKEND,
+            "date": datetime.datetime.now().isoformat(),
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints per benchmark change and returns names of regressions"""
+    regressions = []
+    print("%-40s %12s %12s %8s" % ("benchmark", "baseline us", "current us",
+                                   "change"))
+    for name, result in sorted(results["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print("%-40s %12s %12.2f %8s" % (name, "-",
+                                             result["per_call_us"], "new"))
+            continue
+        change = result["per_call_us"] / base["per_call_us"] - 1
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = " REGRESSION"
+        print("%-40s %12.2f %12.2f %+7.1f%%%s" % (
+            name, base["per_call_us"], result["per_call_us"], change * 100,
+            mark))
+    return regressions
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-o", "--output", action="store", default=None,
+                  help="file to write results to")
+    op.add_option("-c", "--compare", action="store", default=None,
+                  help="baseline results file")
+    op.add_option("-t", "--threshold", action="store", type=float,
+                  default=0.1, help="allowed slowdown, 0.1 is 10%")
+    op.add_option("-k", "--filter", action="store", default="",
+                  help="run benchmarks which names contain this string")
+    op.add_option("-r", "--repeat", action="store", type=int, default=5)
+    op.add_option("--min-time", action="store", type=float, default=0.2)
+    (opts, args) = op.parse_args()
+    names = [name for name in sorted(BENCHMARKS) if opts.filter in name]
+    results = run(names, opts.repeat, opts.min_time)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, opts.threshold)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
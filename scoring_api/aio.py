@@ -0,0 +1,267 @@
+"""asyncio server for the scoring api. Request validation is shared with
+scoring_api.api, handlers are coroutines working with store.AsyncStore"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from http import HTTPStatus
+from optparse import OptionParser
+
+import redis
+
+from scoring_api import codec
+from scoring_api import metrics
+from scoring_api import scoring
+from scoring_api import store
+from scoring_api.api import (OnlineScoreRequest, validate_request,
+                             prepare_batch, make_response, OK, BAD_REQUEST,
+                             NOT_FOUND, INVALID_REQUEST, INTERNAL_ERROR,
+                             ERRORS, MAX_BATCH_SIZE, observe_request,
+                             setup_logging)
+from scoring_api.store import AsyncPrefetchedStore
+
+
+async def method_handler(request, ctx, store):
+    req_body = request['body']
+    if isinstance(req_body, list):
+        ctx['method'] = 'batch'
+        return await batch_method_handler(request, ctx, store)
+    arguments, answer = validate_request(req_body, ctx)
+    if answer is not None:
+        return answer
+    return await handle_request(arguments, store)
+
+
+async def handle_request(arguments, store):
+    """api.handle_request for AsyncStore"""
+    if isinstance(arguments, OnlineScoreRequest):
+        score = await scoring.get_score_async(store, **arguments.as_dict())
+        return dict(score=score), OK
+    client_ids = arguments.client_ids
+    interests = await scoring.get_interests_many_async(store, client_ids)
+    return dict(zip(client_ids, interests)), OK
+
+
+async def batch_method_handler(request, ctx, store):
+    """api.batch_method_handler for AsyncStore"""
+    items = request['body']
+    if len(items) > MAX_BATCH_SIZE:
+        return ("Batch is larger than %s requests" % MAX_BATCH_SIZE,
+                INVALID_REQUEST)
+    prepared, keys, cache_keys = prepare_batch(items)
+    try:
+        values = zip(keys, await store.get_many(keys))
+    except redis.RedisError as e:
+        # items needing the keys read them again and fail on their own
+        logging.error("Failed to prefetch %s batch keys: %s", len(keys), e)
+        values = ()
+    batch_store = AsyncPrefetchedStore(
+        store, values,
+        zip(cache_keys, await store.cache_get_many(cache_keys)))
+    responses, ctx['batch'] = [], []
+    for item_ctx, arguments, answer in prepared:
+        if answer is None:
+            try:
+                answer = await handle_request(arguments, batch_store)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                answer = None, INTERNAL_ERROR
+        responses.append(make_response(*answer, item_ctx.get('errors')))
+        ctx['batch'].append(item_ctx)
+    await batch_store.flush()
+    return responses, OK
+
+
+class AsyncHTTPServer(object):
+    """Minimal HTTP/1.1 server on asyncio streams. Every connection is
+    served by its own task, so requests waiting on the store don't block
+    each other"""
+    router = {
+        "method": method_handler
+    }
+    max_header_size = 64 * 1024
+    # larger request bodies are answered with 400 and connection is closed
+    max_body_size = 1024 * 1024
+    # share of requests which bodies are logged
+    log_body_rate = 1.0
+
+    def __init__(self, store, host='localhost', port=8080,
+                 keepalive_timeout=15):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self.server = None
+
+    def get_request_id(self, headers):
+        return headers.get('http_x_request_id', uuid.uuid4().hex)
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port,
+            limit=self.max_header_size)
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def read_request(self, reader):
+        """Returns (method, path, version, headers, body) or None if client
+        closed connection or didn't send the request in keepalive_timeout.
+        Raises ValueError for malformed or too large requests"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          self.keepalive_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        method, path, version = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if not 0 <= length <= self.max_body_size:
+            raise ValueError("Bad Content-Length: %s" % length)
+        body = b''
+        if length:
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length),
+                                              self.keepalive_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                    ConnectionError):
+                return None
+        return method, path, version, headers, body
+
+    async def dispatch(self, method, path, headers, body):
+        started = time.perf_counter()
+        response, code = {}, OK
+        context = {"request_id": self.get_request_id(headers)}
+        request = None
+        if method != 'POST':
+            code = BAD_REQUEST
+        else:
+            try:
+                request = codec.loads(body)
+            except Exception as e:
+                logging.exception(e)
+                code = BAD_REQUEST
+
+        if request is not None:
+            route = path.strip("/")
+            if (self.log_body_rate >= 1 or
+                    random.random() < self.log_body_rate):
+                logging.info("%s: %s %s", path, body, context["request_id"])
+            if route in self.router:
+                try:
+                    response, code = await self.router[route](
+                        {"body": request, "headers": headers},
+                        context, self.store)
+                except Exception as e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+            else:
+                code = NOT_FOUND
+
+        r = make_response(response, code, context.get('errors'))
+        elapsed = time.perf_counter() - started
+        observe_request(context, code, elapsed)
+        logging.info("%s %s %s %.1fms", context["request_id"], path, code,
+                     elapsed * 1000)
+        return code, r
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    parsed = await self.read_request(reader)
+                except (ValueError, asyncio.LimitOverrunError,
+                        asyncio.IncompleteReadError):
+                    parsed = None
+                    await self.write_response(
+                        writer, BAD_REQUEST,
+                        codec.dumps({"error": ERRORS[BAD_REQUEST],
+                                     "code": BAD_REQUEST}), False)
+                if parsed is None:
+                    break
+                method, path, version, headers, body = parsed
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() !=
+                              'close')
+                if (method == 'GET' and
+                        path.split('?', 1)[0].strip('/') == 'metrics'):
+                    await self.write_response(
+                        writer, OK, metrics.render().encode('utf-8'),
+                        keep_alive, metrics.CONTENT_TYPE)
+                else:
+                    code, r = await self.dispatch(method, path, headers,
+                                                  body)
+                    await self.write_response(writer, code, codec.dumps(r),
+                                              keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, code, payload, keep_alive,
+                             content_type="application/json"):
+        try:
+            reason = HTTPStatus(code).phrase
+        except ValueError:
+            reason = ''
+        head = ("HTTP/1.1 %s %s\r\n"
+                "Content-Type: %s\r\n"
+                "Content-Length: %s\r\n"
+                "Connection: %s\r\n\r\n"
+                % (code, reason, content_type, len(payload),
+                   'keep-alive' if keep_alive else 'close'))
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+async def serve(host, port, store):
+    server = AsyncHTTPServer(store, host, port)
+    await server.start()
+    logging.info("Starting asyncio server at %s", port)
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-pool-size", action="store", type=int,
+                  default=None)
+    op.add_option("--log-body-rate", action="store", type=float,
+                  default=AsyncHTTPServer.log_body_rate)
+    op.add_option("--read-legacy-score-keys", action="store_true",
+                  default=False)
+    op.add_option("--absent-interests-ttl", action="store", type=float,
+                  default=5, help="seconds absent i:<cid> keys are not "
+                  "read again, 0 to disable")
+    op.add_option("--absent-interests-size", action="store", type=int,
+                  default=scoring.ABSENT_INTERESTS.max_size)
+    (opts, args) = op.parse_args()
+    scoring.READ_LEGACY_KEYS = opts.read_legacy_score_keys
+    scoring.ABSENT_INTERESTS_TTL = opts.absent_interests_ttl
+    scoring.ABSENT_INTERESTS.max_size = max(opts.absent_interests_size, 1)
+    listener = setup_logging(opts.log)
+    AsyncHTTPServer.log_body_rate = opts.log_body_rate
+    redis_store = store.AsyncRedisStore(
+        host=opts.redis_host, port=opts.redis_port,
+        pool_size=opts.redis_pool_size)
+    try:
+        asyncio.run(serve("localhost", opts.port, redis_store))
+    except KeyboardInterrupt:
+        pass
+    listener.stop()
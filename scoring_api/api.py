@@ -1,15 +1,33 @@
-import json
 import datetime
 import logging
 import hashlib
 import uuid
 import abc
+import functools
+import hmac
+import os
+import queue
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 from optparse import OptionParser
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 
+import redis
+
+from scoring_api import codec
 from scoring_api import field
+from scoring_api import metrics
+from scoring_api import profiling
 from scoring_api import scoring
 from scoring_api import store
+from scoring_api.store import PrefetchedStore
 from scoring_api.validators import (check_if_email, has_length, starts_with,
                                     is_date, is_age_le, int_in_range,
                                     item_has_type)
@@ -17,12 +35,17 @@ from scoring_api.validators import (check_if_email, has_length, starts_with,
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
 ADMIN_SALT = "42"
+DIGEST_CACHE_SIZE = 10000
+# max number of method requests in one batch
+MAX_BATCH_SIZE = 1000
 OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+LOG_FORMAT = '[%(asctime)s] %(levelname).1s %(message)s'
+LOG_DATE_FORMAT = '%Y.%m.%d %H:%M:%S'
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
@@ -38,6 +61,18 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+NON_FIELD_ERRORS = "__all__"
+METHODS = ("online_score", "clients_interests")
+REQUESTS = metrics.counter(
+    'scoring_requests_total', 'Handled requests by method and response code',
+    ('method', 'code'))
+REQUEST_LATENCY = metrics.histogram(
+    'scoring_request_seconds', 'Request handling latency by method',
+    ('method',))
+NCLIENTS = metrics.histogram(
+    'scoring_clients_interests_nclients',
+    'Number of client ids in clients_interests requests',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
 
 
 class CommonField(field.RequiredField, field.NullableField, field.TypedField):
@@ -95,36 +130,93 @@ class ClientIDsField(CommonField):
                          validators=validators)
 
 
-class Request(abc.ABC):
+class RequestMeta(abc.ABCMeta):
+    """Creates __slots__ for declared fields of classes defined with
+    compact=True, so their instances have no __dict__ as long as all bases
+    are slotted too"""
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        if kwargs.get('compact') and '__slots__' not in namespace:
+            slotted = {slot for base in bases for klass in base.__mro__
+                       for slot in getattr(klass, '__slots__', ())}
+            slots = ['_' + attr_name for attr_name, attr_val
+                     in namespace.items()
+                     if isinstance(attr_val, field.Field)] + ['valid']
+            namespace['__slots__'] = tuple(slot for slot in slots
+                                           if slot not in slotted)
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+
+class Request(metaclass=RequestMeta):
+    """Base for requests with declared fields. Field table and validation
+    plan are built once per class when it is created.
+    Subclass defined with compact=True keeps values in __slots__ and drops
+    undeclared keys of incoming request"""
+    __slots__ = ()
+    fields = ()
+    compact = False
+    error_messages = {}
+    _validation_plan = ()
+
+    def __init_subclass__(cls, compact=False, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            for attr_name, attr_val in vars(klass).items():
+                if isinstance(attr_val, field.ValidatedField):
+                    fields[attr_name] = attr_val
+                else:
+                    fields.pop(attr_name, None)
+        cls.fields = tuple(fields.items())
+        cls.compact = compact
+        cls._validation_plan = tuple((attr_name, attr_val.compile())
+                                     for attr_name, attr_val in cls.fields)
+
     def __init__(self, request):
         self.valid = True
-        for attr_name, attr_value in request.items():
-            setattr(self, attr_name, attr_value)
-        self.fields = [
-            (attr_name, attr_val)
-            for attr_name, attr_val in self.__class__.__dict__.items()
-            if isinstance(attr_val, field.ValidatedField)
-        ]
+        if self.compact:
+            for attr_name, attr_val in self.fields:
+                if attr_name in request:
+                    attr_val.__set__(self, request[attr_name])
+        else:
+            for attr_name, attr_value in request.items():
+                setattr(self, attr_name, attr_value)
 
     @abc.abstractmethod
     def validate(self):
-        invalid_fields = []
-        for attr_name, attr_val in self.fields:
-            try:
-                attr_val.validate(self)
-            except Exception as e:
-                invalid_fields.append(attr_name)
-        if invalid_fields:
-            raise Exception("invalid fields: " + ', '.join(invalid_fields))
+        errors = self.check()
+        if errors:
+            raise Exception(self.error_message(errors))
         else:
             return
 
+    def check(self):
+        """Validates request without raising. Returns dict of field name to
+        error code, empty for valid request. Errors of the whole request are
+        stored under NON_FIELD_ERRORS"""
+        errors = {}
+        for attr_name, check in self._validation_plan:
+            try:
+                error = check(self)
+            except Exception:
+                error = 'invalid'
+            if error is not None:
+                errors[attr_name] = error
+        return errors
+
+    def error_message(self, errors):
+        invalid_fields = [attr_name for attr_name in errors
+                          if attr_name != NON_FIELD_ERRORS]
+        if invalid_fields:
+            return "invalid fields: " + ', '.join(invalid_fields)
+        error = errors[NON_FIELD_ERRORS]
+        return self.error_messages.get(error, error)
+
     def as_dict(self):
         return dict((attr_name, getattr(self, attr_name))
                     for attr_name, attr_val in self.fields)
 
 
-class ClientsInterestsRequest(Request):
+class ClientsInterestsRequest(Request, compact=True):
     client_ids = ClientIDsField(required=True, nullable=False)
     date = DateField(required=False, nullable=True, fmt='%d.%m.%Y')
 
@@ -136,7 +228,7 @@ class ClientsInterestsRequest(Request):
         return len(self.client_ids)
 
 
-class OnlineScoreRequest(Request):
+class OnlineScoreRequest(Request, compact=True):
     first_name = CharField(required=False, nullable=True)
     last_name = CharField(required=False, nullable=True)
     email = EmailField(required=False, nullable=True)
@@ -145,13 +237,21 @@ class OnlineScoreRequest(Request):
                              fmt='%d.%m.%Y', years=70)
     gender = GenderField(range_=[0, 1, 2], required=False, nullable=True)
 
+    error_messages = {
+        'no_field_pairs': "There is no available field pairs",
+    }
+
     def validate(self):
         super().validate()
-        if (self.phone and self.email or self.first_name and self.last_name or
-           self.birthday and self.gender is not None):
-            return
-        else:
-            raise Exception("There is no available field pairs")
+
+    def check(self):
+        errors = super().check()
+        if errors or (self.phone and self.email or
+                      self.first_name and self.last_name or
+                      self.birthday and self.gender is not None):
+            return errors
+        errors[NON_FIELD_ERRORS] = 'no_field_pairs'
+        return errors
 
     @property
     def has(self):
@@ -159,7 +259,7 @@ class OnlineScoreRequest(Request):
                 if getattr(self, field_name) is not None]
 
 
-class MethodRequest(Request):
+class MethodRequest(Request, compact=True):
     account = CharField(required=False, nullable=True)
     login = CharField(required=True, nullable=True)
     token = CharField(required=True, nullable=True)
@@ -174,61 +274,191 @@ class MethodRequest(Request):
         super().validate()
 
 
+class HourlyDigest(object):
+    """Admin digest of the current hour. It is computed once and reused until
+    the next hour begins"""
+    def __init__(self, salt, clock=time.time):
+        self.salt = salt
+        self.clock = clock
+        self.current = (0, None)
+
+    def get(self):
+        expires, digest = self.current
+        now = self.clock()
+        if now >= expires:
+            hour = datetime.datetime.fromtimestamp(now).replace(
+                minute=0, second=0, microsecond=0)
+            to_hash = (hour.strftime("%Y%m%d%H") + self.salt).encode('UTF-8')
+            digest = hashlib.sha512(to_hash).hexdigest()
+            expires = (hour + datetime.timedelta(hours=1)).timestamp()
+            self.current = (expires, digest)
+        return digest
+
+
+admin_digest = HourlyDigest(ADMIN_SALT)
+
+
+@functools.lru_cache(maxsize=DIGEST_CACHE_SIZE)
+def user_digest(account, login):
+    to_hash = account + login + SALT
+    return hashlib.sha512(to_hash.encode(encoding='UTF-8')).hexdigest()
+
+
 def digestize(request):
     if request.is_admin:
-        to_hash = datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT
-        digest = hashlib.sha512(to_hash.encode(encoding='UTF-8')).hexdigest()
+        return admin_digest.get()
     else:
-        to_hash = request.account + request.login + SALT
-        digest = hashlib.sha512(to_hash.encode(encoding='UTF-8')).hexdigest()
-    return digest
+        return user_digest(request.account, request.login)
 
 
 def check_auth(request):
-    return digestize(request) == request.token
-
-
-def method_handler(request, ctx, store):
-    req_body = request['body']
+    token = request.token
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(digestize(request).encode('UTF-8'),
+                               token.encode('UTF-8'))
+
+
+def validate_request(req_body, ctx):
+    """Checks method request, its auth and arguments. Returns (arguments,
+    None) for a request which needs the store, where arguments is
+    OnlineScoreRequest or ClientsInterestsRequest, or (None, (response,
+    code)) for a request answered without it. Shared by both servers, only
+    store calls differ"""
     method_request = MethodRequest(req_body)
-    try:
-        method_request.validate()
-    except Exception as e:
-        return str(e), INVALID_REQUEST
+    # label of request metrics, arbitrary client values are not kept
+    ctx['method'] = (method_request.method
+                     if method_request.method in METHODS else 'unknown')
+    errors = method_request.check()
+    if errors:
+        ctx['errors'] = errors
+        return None, (method_request.error_message(errors), INVALID_REQUEST)
     if not check_auth(method_request):
-        return ERRORS[FORBIDDEN], FORBIDDEN
+        return None, (ERRORS[FORBIDDEN], FORBIDDEN)
     if method_request.method == 'online_score':
-        return handle_online_score(method_request, ctx, store)
+        arguments = OnlineScoreRequest(method_request.arguments)
     elif method_request.method == 'clients_interests':
-        return handle_clients_interests(method_request, ctx, store)
+        arguments = ClientsInterestsRequest(method_request.arguments)
+    else:
+        return None, ("Unknown method - %s" % method_request.method,
+                      NOT_FOUND)
+    errors = arguments.check()
+    if errors:
+        ctx['errors'] = errors
+        return None, (arguments.error_message(errors), INVALID_REQUEST)
+    if isinstance(arguments, OnlineScoreRequest):
+        ctx['has'] = arguments.has
+        if method_request.is_admin:
+            return None, (dict(score=42), OK)
     else:
-        return ERRORS[NOT_FOUND], "Unknown method - %s" % method_request.method
+        ctx['nclients'] = arguments.nclients
+        NCLIENTS.observe(ctx['nclients'])
+    return arguments, None
 
 
-def handle_online_score(method_request, ctx, store):
-    conc_method_req = OnlineScoreRequest(method_request.arguments)
-    try:
-        conc_method_req.validate()
-    except Exception as e:
-        return str(e), INVALID_REQUEST
-    ctx['has'] = conc_method_req.has
-    if method_request.is_admin:
-        return dict(score=42), OK
-    else:
-        score = scoring.get_score(store, **conc_method_req.as_dict())
+def handle_request(arguments, store):
+    """Answers request validated by validate_request"""
+    if isinstance(arguments, OnlineScoreRequest):
+        score = scoring.get_score(store, **arguments.as_dict())
         return dict(score=score), OK
+    client_ids = arguments.client_ids
+    interests = scoring.get_interests_many(store, client_ids)
+    return dict(zip(client_ids, interests)), OK
 
 
-def handle_clients_interests(method_request, ctx, store):
-    conc_method_req = ClientsInterestsRequest(method_request.arguments)
+def method_handler(request, ctx, store):
+    req_body = request['body']
+    if isinstance(req_body, list):
+        ctx['method'] = 'batch'
+        return batch_method_handler(request, ctx, store)
+    arguments, answer = validate_request(req_body, ctx)
+    if answer is not None:
+        return answer
+    return handle_request(arguments, store)
+
+
+def observe_request(ctx, code, elapsed):
+    """Records request with handling time in seconds to metrics"""
+    method = ctx.get('method', 'none')
+    REQUESTS.inc(method, str(code))
+    REQUEST_LATENCY.observe(elapsed, method)
+
+
+def make_response(response, code, errors=None):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+    if errors:
+        r["fields"] = errors
+    return r
+
+
+def batch_keys(requests):
+    """Returns (keys, cache_keys) which validated requests are going to
+    read"""
+    keys, cache_keys = {}, {}
+    for arguments in requests:
+        if isinstance(arguments, OnlineScoreRequest):
+            for key in scoring.score_cache_keys(**arguments.as_dict()):
+                cache_keys[key] = None
+        else:
+            for key in scoring.unknown_interests_keys(
+                    [scoring._interests_key(cid)
+                     for cid in arguments.client_ids]):
+                keys[key] = None
+    return list(keys), list(cache_keys)
+
+
+def prepare_batch(items):
+    """Validates and authenticates every batch item before the store is
+    touched. Returns (prepared, keys, cache_keys) where prepared has
+    (item_ctx, arguments, answer) of validate_request for every item and
+    keys are read by the items which need the store"""
+    prepared = []
+    for item in items:
+        item_ctx = {}
+        arguments, answer = None, (None, BAD_REQUEST)
+        if isinstance(item, dict):
+            try:
+                arguments, answer = validate_request(item, item_ctx)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                answer = None, INTERNAL_ERROR
+        prepared.append((item_ctx, arguments, answer))
+    keys, cache_keys = batch_keys([arguments for _, arguments, _ in prepared
+                                   if arguments is not None])
+    return prepared, keys, cache_keys
+
+
+def batch_method_handler(request, ctx, store):
+    """Handles list of method requests. Items are validated first, store
+    keys of the valid ones are read before processing and cache writes are
+    sent together afterwards"""
+    items = request['body']
+    if len(items) > MAX_BATCH_SIZE:
+        return ("Batch is larger than %s requests" % MAX_BATCH_SIZE,
+                INVALID_REQUEST)
+    prepared, keys, cache_keys = prepare_batch(items)
     try:
-        conc_method_req.validate()
-    except Exception as e:
-        return str(e), INVALID_REQUEST
-    ctx['nclients'] = conc_method_req.nclients
-    response = {cid: scoring.get_interests(store, cid)
-                for cid in conc_method_req.client_ids}
-    return response, OK
+        values = zip(keys, store.get_many(keys))
+    except redis.RedisError as e:
+        # items needing the keys read them again and fail on their own
+        logging.error("Failed to prefetch %s batch keys: %s", len(keys), e)
+        values = ()
+    batch_store = PrefetchedStore(
+        store, values, zip(cache_keys, store.cache_get_many(cache_keys)))
+    responses, ctx['batch'] = [], []
+    for item_ctx, arguments, answer in prepared:
+        if answer is None:
+            try:
+                answer = handle_request(arguments, batch_store)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                answer = None, INTERNAL_ERROR
+        responses.append(make_response(*answer, item_ctx.get('errors')))
+        ctx['batch'].append(item_ctx)
+    batch_store.flush()
+    return responses, OK
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
@@ -236,28 +466,80 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         "method": method_handler
     }
     store = store.RedisStore()
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, with Nagle's algorithm the
+    # body of persistent connection waits for client's delayed ACK
+    disable_nagle_algorithm = True
+    # share of requests which bodies are logged
+    log_body_rate = 1.0
+    # seconds idle persistent connection is kept open
+    timeout = 15
+    # requests served over one connection before closing it, 0 for no limit
+    max_requests = 100
+    # profiling.Profiler of selected requests, disabled if None
+    profiler = None
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        self.slot = None
+
+    def parse_request(self):
+        # a worker slot is taken once the request line has arrived, so idle
+        # persistent connections wait for the next request without one
+        slots = getattr(self.server, 'slots', None)
+        if slots is not None:
+            slots.acquire()
+            self.slot = slots
+        return super().parse_request()
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            slot, self.slot = self.slot, None
+            if slot is not None:
+                slot.release()
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def log_message(self, format, *args):
+        logging.debug("%s - " + format, self.address_string(), *args)
+
     def do_POST(self):
+        started = time.perf_counter()
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            length = int(self.headers['Content-Length'])
+            data_string = self.rfile.read(length)
         except Exception as e:
             logging.exception(e)
             code = BAD_REQUEST
+            # body boundary is unknown, connection can't be reused
+            self.close_connection = True
+        else:
+            try:
+                request = codec.loads(data_string)
+            except Exception as e:
+                logging.exception(e)
+                code = BAD_REQUEST
 
-        if request:
+        if request is not None:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string,
-                                        context["request_id"]))
+            if (self.log_body_rate >= 1 or
+                    random.random() < self.log_body_rate):
+                logging.info("%s: %s %s", self.path, data_string,
+                             context["request_id"])
             if path in self.router:
+                route = self.router[path]
+                if (self.profiler is not None and
+                        self.profiler.wanted(self.headers)):
+                    route = functools.partial(self.profiler.call, route)
                 try:
-                    response, code = self.router[path](
+                    response, code = route(
                         {"body": request,
                          "headers": self.headers},
                         context, self.store)
@@ -267,32 +549,267 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             else:
                 code = NOT_FOUND
 
+        r = make_response(response, code, context.get('errors'))
+        payload = codec.dumps(r)
+        # recorded before the response is sent, so a client which got the
+        # response sees it counted
+        observe_request(context, code, time.perf_counter() - started)
+        self.requests_served += 1
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if self.close_connection or (
+                self.max_requests and
+                self.requests_served >= self.max_requests):
+            self.send_header("Connection", "close")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"),
-                 "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode('UTF-8'))
+        self.wfile.write(payload)
+        logging.info("%s %s %s %.1fms", context["request_id"], self.path,
+                     code, (time.perf_counter() - started) * 1000)
         return
 
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].strip('/')
+        if path == 'metrics':
+            code, content_type = OK, metrics.CONTENT_TYPE
+            payload = metrics.render().encode('utf-8')
+        elif (path == 'profile' and self.profiler is not None and
+              self.profiler.authorized(self.headers)):
+            code, content_type = OK, "text/plain; charset=utf-8"
+            payload = self.profiler.summary().encode('utf-8')
+        else:
+            code, content_type = NOT_FOUND, "application/json"
+            payload = codec.dumps(make_response(None, NOT_FOUND))
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
 
-if __name__ == "__main__":
-    op = OptionParser()
-    op.add_option("-p", "--port", action="store", type=int, default=8080)
-    op.add_option("-l", "--log", action="store", default=None)
-    (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s',
-                        datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+
+class DeferredQueueHandler(QueueHandler):
+    """Puts records to bounded queue without formatting them, so formatting
+    and writing happen in listener thread. Records which don't fit into the
+    queue are dropped and counted"""
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(filename=None, level=logging.INFO, queue_size=10000):
+    """Configures root logger to write records from background thread.
+    Returns started QueueListener, stop it to flush pending records"""
+    if filename:
+        handler = logging.FileHandler(filename)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    records = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class ThreadPoolHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTPServer which reads every connection in its own thread while at
+    most `workers` requests are handled at a time, so idle persistent
+    connections don't hold a worker"""
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_cls, workers=4, **kwargs):
+        super().__init__(server_address, handler_cls, **kwargs)
+        self.slots = threading.BoundedSemaphore(max(workers, 1))
+
+
+class ReusePortHTTPServer(ThreadPoolHTTPServer):
+    """ThreadPoolHTTPServer bound with SO_REUSEPORT, so several processes can
+    listen on the same address and let the kernel balance connections. Every
+    process handles one request at a time by default"""
+    def __init__(self, server_address, handler_cls, workers=1, **kwargs):
+        super().__init__(server_address, handler_cls, workers, **kwargs)
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve(server):
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     server.server_close()
+    profiler = getattr(server.RequestHandlerClass, 'profiler', None)
+    if profiler is not None:
+        profiler.dump()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_threaded(address, workers, store_factory):
+    MainHTTPHandler.store = store_factory()
+    signal.signal(signal.SIGTERM, _interrupt)
+    server = ThreadPoolHTTPServer(address, MainHTTPHandler, workers=workers)
+    logging.info("Starting server at %s with %s threads", address[1],
+                 workers)
+    serve(server)
+
+
+def _spawn_worker(address, store_factory, log_file, metrics_dir):
+    """Forks worker process serving address, returns its pid. The child
+    never returns into the caller's code"""
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    code = 1
+    try:
+        # stop serve_forever on SIGTERM of parent as on Ctrl-C, so profile
+        # stats and metrics are written before exit
+        signal.signal(signal.SIGTERM, _interrupt)
+        # log writer thread of parent doesn't exist after fork
+        listener = setup_logging(log_file)
+        try:
+            # every worker owns its redis connections
+            MainHTTPHandler.store = store_factory()
+            # /metrics may be answered by any worker, it reports all of them.
+            # Values of parent are dropped to not be counted by every worker
+            metrics.REGISTRY.clear()
+            metrics.share(metrics_dir)
+            server = ReusePortHTTPServer(address, MainHTTPHandler)
+            logging.info("Worker %s listening at %s", os.getpid(),
+                         address[1])
+            serve(server)
+            metrics.REGISTRY.write()
+            code = 0
+        except Exception as e:
+            logging.exception("Worker %s failed: %s", os.getpid(), e)
+        finally:
+            listener.stop()
+    finally:
+        os._exit(code)
+
+
+def run_prefork(address, workers, store_factory, log_file=None,
+                restart_delay=1.0):
+    """Runs `workers` forked servers until SIGTERM or KeyboardInterrupt.
+    Workers which exit meanwhile are started again after restart_delay.
+    Workers share metrics through a temporary directory"""
+    metrics_dir = tempfile.mkdtemp(prefix='scoring-metrics-')
+    try:
+        _run_workers(address, workers, store_factory, log_file,
+                     restart_delay, metrics_dir)
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def _run_workers(address, workers, store_factory, log_file, restart_delay,
+                 metrics_dir):
+    children = {_spawn_worker(address, store_factory, log_file, metrics_dir)
+                for _ in range(workers)}
+    stopping = []
+
+    def stop_children(signum, frame):
+        stopping.append(signum)
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop_children)
+    logging.info("Starting server at %s with %s processes", address[1],
+                 workers)
+    while children:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        except KeyboardInterrupt:
+            stop_children(signal.SIGINT, None)
+            continue
+        if pid not in children:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logging.error("Worker %s exited with code %s, restarting", pid,
+                          os.waitstatus_to_exitcode(status))
+            time.sleep(restart_delay)
+            if not stopping:
+                children.add(_spawn_worker(address, store_factory, log_file,
+                                           metrics_dir))
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("-m", "--mode", action="store", type="choice",
+                  choices=["thread", "prefork"], default="thread")
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-pool-size", action="store", type=int,
+                  default=None)
+    op.add_option("--cache-size", action="store", type=int, default=0)
+    op.add_option("--read-legacy-score-keys", action="store_true",
+                  default=False)
+    op.add_option("--absent-interests-ttl", action="store", type=float,
+                  default=5, help="seconds absent i:<cid> keys are not "
+                  "read again, 0 to disable")
+    op.add_option("--absent-interests-size", action="store", type=int,
+                  default=scoring.ABSENT_INTERESTS.max_size)
+    op.add_option("--keepalive-timeout", action="store", type=float,
+                  default=MainHTTPHandler.timeout)
+    op.add_option("--max-requests", action="store", type=int,
+                  default=MainHTTPHandler.max_requests)
+    op.add_option("--log-body-rate", action="store", type=float,
+                  default=MainHTTPHandler.log_body_rate)
+    op.add_option("--profile", action="store_true", default=False,
+                  help="profile every request")
+    op.add_option("--profile-rate", action="store", type=float, default=0.0)
+    op.add_option("--profile-token", action="store", default=None,
+                  help="profile requests with X-Profile header equal to it")
+    op.add_option("--profile-dir", action="store", default=None)
+    (opts, args) = op.parse_args()
+    scoring.READ_LEGACY_KEYS = opts.read_legacy_score_keys
+    scoring.ABSENT_INTERESTS_TTL = opts.absent_interests_ttl
+    scoring.ABSENT_INTERESTS.max_size = max(opts.absent_interests_size, 1)
+    listener = setup_logging(opts.log)
+    address = ("localhost", opts.port)
+    if opts.profile or opts.profile_rate > 0 or opts.profile_token:
+        MainHTTPHandler.profiler = profiling.Profiler(
+            rate=1.0 if opts.profile else opts.profile_rate,
+            token=opts.profile_token, output_dir=opts.profile_dir)
+    workers = max(opts.workers, 1)
+    MainHTTPHandler.timeout = opts.keepalive_timeout
+    MainHTTPHandler.max_requests = opts.max_requests
+    MainHTTPHandler.log_body_rate = opts.log_body_rate
+
+    def store_factory():
+        redis_store = store.RedisStore(host=opts.redis_host,
+                                       port=opts.redis_port,
+                                       pool_size=opts.redis_pool_size)
+        if opts.cache_size > 0:
+            return store.CachingStore(redis_store, max_size=opts.cache_size)
+        return redis_store
+
+    if opts.mode == "prefork":
+        run_prefork(address, workers, store_factory, log_file=opts.log)
+    else:
+        run_threaded(address, workers, store_factory)
+    listener.stop()
@@ -0,0 +1,227 @@
+"""Offline scoring of JSONL file of method requests. Lines are read in chunks
+which are handled by a process pool, results are written as JSONL in input
+order. Only `window` chunks are in flight, so memory use doesn't depend on
+input size:
+
+    python -m scoring_api.bulk -i requests.jsonl -o responses.jsonl -w 4
+"""
+import collections
+import functools
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+from scoring_api import codec
+from scoring_api import scoring
+from scoring_api import store
+from scoring_api.api import (method_handler, batch_method_handler,
+                             make_response, setup_logging, BAD_REQUEST,
+                             INTERNAL_ERROR, MAX_BATCH_SIZE, LOG_FORMAT,
+                             LOG_DATE_FORMAT)
+
+# store of a pool worker, created by _init_worker
+_store = None
+
+
+def make_store(host='localhost', port=6379, pool_size=None, cache_size=0):
+    redis_store = store.RedisStore(host=host, port=port, pool_size=pool_size)
+    if cache_size > 0:
+        return store.CachingStore(redis_store, max_size=cache_size)
+    return redis_store
+
+
+def score_lines(lines, store):
+    """Returns encoded response for every line. Requests of a chunk share
+    one prefetch of store keys as in batch_method_handler, if it fails they
+    are answered with INTERNAL_ERROR"""
+    parsed = []
+    for line in lines:
+        try:
+            parsed.append(codec.loads(line))
+        except ValueError:
+            parsed.append(None)
+    items = [request for request in parsed if isinstance(request, dict)]
+    responses = []
+    for i in range(0, len(items), MAX_BATCH_SIZE):
+        batch = items[i:i + MAX_BATCH_SIZE]
+        try:
+            responses.extend(batch_method_handler(
+                {"body": batch, "headers": {}}, {}, store)[0])
+        except Exception as e:
+            logging.exception("Unexpected error: %s" % e)
+            responses.extend([make_response(None, INTERNAL_ERROR)] *
+                             len(batch))
+    responses = iter(responses)
+    results = []
+    for request in parsed:
+        if isinstance(request, dict):
+            r = next(responses)
+        elif isinstance(request, list):
+            ctx = {}
+            try:
+                response, code = method_handler(
+                    {"body": request, "headers": {}}, ctx, store)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                response, code = None, INTERNAL_ERROR
+            r = make_response(response, code, ctx.get('errors'))
+        else:
+            r = make_response(None, BAD_REQUEST)
+        results.append(codec.dumps(r))
+    return results
+
+
+def _init_worker(store_factory, log_file):
+    global _store
+    # queue listener of parent process doesn't exist after fork
+    logging.basicConfig(filename=log_file, format=LOG_FORMAT,
+                        datefmt=LOG_DATE_FORMAT, level=logging.INFO,
+                        force=True)
+    _store = store_factory()
+
+
+def _score_chunk(lines):
+    return score_lines(lines, _store)
+
+
+def read_chunks(infile, chunk_size):
+    chunk = []
+    for line in infile:
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class Progress(object):
+    """Writes number of handled requests and throughput to stream every
+    `interval` seconds"""
+    def __init__(self, stream, interval=5, clock=time.monotonic):
+        self.stream = stream
+        self.interval = interval
+        self.clock = clock
+        self.started = self.reported = clock()
+        self.count = 0
+
+    def report(self, final=False):
+        elapsed = self.clock() - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0
+        self.stream.write("%s %d requests in %.1fs, %.0f req/s\n" % (
+            "done:" if final else "progress:", self.count, elapsed, rate))
+        self.stream.flush()
+
+    def update(self, count):
+        self.count += count
+        now = self.clock()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.report()
+
+
+class _Done(object):
+    """Result holder with Future interface for in-process scoring"""
+    def __init__(self, func, *args):
+        self.value, self.error = None, None
+        try:
+            self.value = func(*args)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def run(infile, outfile, store_factory, workers=4, chunk_size=100,
+        window=None, progress=None, log_file=None):
+    """Scores lines of binary infile to outfile. Up to `window` chunks of
+    chunk_size lines are queued to workers, reading waits for the oldest one
+    when window is full. With workers=0 lines are scored in this process.
+    Every line of a chunk which failed as a whole is answered with
+    INTERNAL_ERROR, so output stays aligned with input"""
+    window = window or max(workers, 1) * 2
+    if workers > 0:
+        executor = ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(store_factory, log_file))
+        submit = functools.partial(executor.submit, _score_chunk)
+    else:
+        executor = None
+        local_store = store_factory()
+
+        def submit(chunk):
+            return _Done(score_lines, chunk, local_store)
+
+    pending = collections.deque()
+
+    def write_oldest():
+        future, size = pending.popleft()
+        try:
+            results = future.result()
+        except Exception as e:
+            logging.exception("Failed to score chunk: %s" % e)
+            results = [codec.dumps(make_response(None, INTERNAL_ERROR))] * size
+        outfile.write(b"".join(r + b"\n" for r in results))
+        if progress is not None:
+            progress.update(len(results))
+
+    try:
+        for chunk in read_chunks(infile, chunk_size):
+            if len(pending) >= window:
+                write_oldest()
+            pending.append((submit(chunk), len(chunk)))
+        while pending:
+            write_oldest()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    outfile.flush()
+    if progress is not None:
+        progress.report(final=True)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-i", "--input", action="store", default="-")
+    op.add_option("-o", "--output", action="store", default="-")
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-w", "--workers", action="store", type=int, default=4)
+    op.add_option("--chunk-size", action="store", type=int, default=100)
+    op.add_option("--window", action="store", type=int, default=None,
+                  help="max number of chunks in flight")
+    op.add_option("--progress-interval", action="store", type=float,
+                  default=5)
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-pool-size", action="store", type=int,
+                  default=None)
+    op.add_option("--cache-size", action="store", type=int, default=0)
+    op.add_option("--read-legacy-score-keys", action="store_true",
+                  default=False)
+    (opts, args) = op.parse_args()
+    scoring.READ_LEGACY_KEYS = opts.read_legacy_score_keys
+    listener = setup_logging(opts.log)
+    infile = (sys.stdin.buffer if opts.input == "-"
+              else open(opts.input, "rb"))
+    outfile = (sys.stdout.buffer if opts.output == "-"
+               else open(opts.output, "wb"))
+    store_factory = functools.partial(
+        make_store, host=opts.redis_host, port=opts.redis_port,
+        pool_size=opts.redis_pool_size, cache_size=opts.cache_size)
+    try:
+        run(infile, outfile, store_factory, workers=max(opts.workers, 0),
+            chunk_size=max(opts.chunk_size, 1), window=opts.window,
+            progress=Progress(sys.stderr, opts.progress_interval),
+            log_file=opts.log)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        infile.close()
+        outfile.close()
+    listener.stop()
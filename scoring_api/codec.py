@@ -0,0 +1,34 @@
+"""JSON codec of the servers and scoring. loads takes bytes or str, dumps
+returns utf-8 bytes. orjson is used when it is installed, stdlib json
+otherwise. Note that orjson decodes integers beyond 64 bit as floats"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def std_loads(data):
+    return json.loads(data)
+
+
+def std_dumps(obj):
+    return json.dumps(obj).encode('UTF-8')
+
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    loads = orjson.loads
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bit, stdlib can encode them
+            return std_dumps(obj)
+else:
+    BACKEND = 'json'
+    loads = std_loads
+    dumps = std_dumps
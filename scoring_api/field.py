@@ -1,4 +1,10 @@
 """Descriptor field module"""
+from scoring_api.validators import as_check
+
+# marker of value which was never set
+MISSING = object()
+# returned by validation check to skip the rest of field's checks
+STOP = object()
 
 
 class Field(object):
@@ -28,6 +34,9 @@ class Field(object):
 class ValidatedField(Field):
     """
     Field descriptor with set validators.
+    Validation is compiled once into flat function which returns error code
+    instead of raising: subclasses contribute checks with _on_missing and
+    _steps instead of chaining validate calls.
     Args:
         validators: list of callable.
     """
@@ -37,12 +46,59 @@ class ValidatedField(Field):
         if not validators:
             validators = []
         self.validators = validators
+        self._plan = None
         super().__init__(**kwargs)
 
-    def validate(self, obj):
+    def __set_name__(self, owner, name):
+        super().__set_name__(owner, name)
+        self._plan = None
+
+    def _on_missing(self):
+        """Called when value was never set. Returns STOP to skip validation,
+        error code to fail it or None to validate default value"""
+        return None
+
+    def _steps(self):
+        """Returns list of checks applied to value in order. Check returns
+        None for valid value, STOP to skip the rest or error code"""
+        return [as_check(validator) for validator in self.validators]
+
+    def _raise(self, obj, error):
+        """Raises exception for error returned by check"""
         val = getattr(obj, self.name, self.default)
         for validator in self.validators:
             validator(val)
+        raise ValueError("Invalid value: %s" % error)
+
+    def compile(self):
+        """Returns function which checks field of given object and returns
+        error code or None"""
+        name, default, on_missing = self.name, self.default, self._on_missing
+        steps = tuple(self._steps())
+
+        def check(obj):
+            val = getattr(obj, name, MISSING)
+            if val is MISSING:
+                error = on_missing()
+                if error is not None:
+                    return None if error is STOP else error
+                val = default
+            for step in steps:
+                error = step(val)
+                if error is not None:
+                    return None if error is STOP else error
+            return None
+        return check
+
+    def check(self, obj):
+        if self._plan is None:
+            self._plan = self.compile()
+        return self._plan(obj)
+
+    def validate(self, obj):
+        error = self.check(obj)
+        if error is not None:
+            self._raise(obj, error)
         return None
 
 
@@ -51,14 +107,21 @@ class NullableField(ValidatedField):
         self.nullable = nullable
         super().__init__(**kwargs)
 
-    def validate(self, obj):
-        val = getattr(obj, self.name, self.default)
-        if self.nullable and not val:
-            return
-        elif not self.nullable and not val and val != 0:
-            raise ValueError("None value in not nullable field")
+    def _steps(self):
+        if self.nullable:
+            def check_nullable(val):
+                if not val:
+                    return STOP
         else:
-            super().validate(obj)
+            def check_nullable(val):
+                if not val and val != 0:
+                    return 'null'
+        return [check_nullable] + super()._steps()
+
+    def _raise(self, obj, error):
+        if error == 'null':
+            raise ValueError("None value in not nullable field")
+        super()._raise(obj, error)
 
 
 class RequiredField(ValidatedField):
@@ -69,13 +132,13 @@ class RequiredField(ValidatedField):
         self.required = required
         super().__init__(**kwargs)
 
-    def validate(self, obj):
-        if not hasattr(obj, self.name) and self.required:
+    def _on_missing(self):
+        return 'required' if self.required else STOP
+
+    def _raise(self, obj, error):
+        if error == 'required':
             raise ValueError("Missing required field")
-        elif not hasattr(obj, self.name) and not self.required:
-            return
-        else:
-            super().validate(obj)
+        super()._raise(obj, error)
 
 
 class TypedField(ValidatedField):
@@ -84,10 +147,16 @@ class TypedField(ValidatedField):
         self.type_ = type_
         super().__init__(**kwargs)
 
-    def validate(self, obj):
-        val = getattr(obj, self.name, self.default)
-        if not isinstance(val, self.type_):
+    def _steps(self):
+        type_ = self.type_
+
+        def check_type(val):
+            if not isinstance(val, type_):
+                return 'type'
+        return [check_type] + super()._steps()
+
+    def _raise(self, obj, error):
+        if error == 'type':
             raise TypeError("Incorrect type, expected any of %s"
                             % str(self.type_))
-        else:
-            super().validate(obj)
+        super()._raise(obj, error)
@@ -0,0 +1,195 @@
+"""Encodings of client interests stored under i:<cid> keys. Besides json
+there is compact encoding, where interests from INTERESTS are stored as one
+byte ids and others as length-prefixed literals, and msgpack if it is
+installed. decode detects encoding by the first byte, so keys of different
+encodings can be mixed during migration:
+
+    python -m scoring_api.interests -f compact --redis-host localhost
+"""
+import functools
+import logging
+from optparse import OptionParser
+
+import redis
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from scoring_api import codec
+
+JSON = 'json'
+COMPACT = 'compact'
+MSGPACK = 'msgpack'
+FORMATS = (JSON, COMPACT, MSGPACK)
+# ids are positions in this tuple, so it may only be appended to
+INTERESTS = ("cars", "pets", "travel", "hi-tech", "sport", "music", "books",
+             "tv", "cinema", "geek", "otus")
+INTEREST_IDS = {name: i for i, name in enumerate(INTERESTS)}
+COMPACT_MARKER = 0x01
+LITERAL = 0xff
+assert len(INTERESTS) < LITERAL
+# few combinations of interests are common, their decoded values are reused
+DECODE_CACHE_SIZE = 4096
+
+
+def detect(data):
+    if isinstance(data, str) or not data:
+        return JSON
+    first = data[0]
+    if first == COMPACT_MARKER:
+        return COMPACT
+    if 0x90 <= first <= 0x9f or first in (0xdc, 0xdd):
+        return MSGPACK
+    return JSON
+
+
+def _encode_compact(interests):
+    out = bytearray((COMPACT_MARKER,))
+    for name in interests:
+        interest_id = INTEREST_IDS.get(name)
+        if interest_id is not None:
+            out.append(interest_id)
+            continue
+        literal = name.encode('utf-8')
+        out.append(LITERAL)
+        length = len(literal)
+        while length >= 0x80:
+            out.append(length & 0x7f | 0x80)
+            length >>= 7
+        out.append(length)
+        out += literal
+    return bytes(out)
+
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def _decode_compact(data):
+    body = data[1:]
+    try:
+        if LITERAL not in body:
+            return tuple(INTERESTS[interest_id] for interest_id in body)
+        interests, i = [], 0
+        while i < len(body):
+            interest_id = body[i]
+            i += 1
+            if interest_id != LITERAL:
+                interests.append(INTERESTS[interest_id])
+                continue
+            length, shift = 0, 0
+            while True:
+                byte = body[i]
+                i += 1
+                length |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            if i + length > len(body):
+                raise IndexError(i + length)
+            interests.append(body[i:i + length].decode('utf-8'))
+            i += length
+        return tuple(interests)
+    except IndexError:
+        raise ValueError('Broken compact interests: %r' % data)
+
+
+def encode(interests, fmt=COMPACT):
+    """Returns bytes of interests list in format fmt. Lists with values other
+    than strings are encoded as json"""
+    interests = list(interests)
+    if fmt == COMPACT and all(isinstance(name, str) for name in interests):
+        return _encode_compact(interests)
+    if fmt == MSGPACK:
+        if msgpack is None:
+            raise ValueError('msgpack is not installed')
+        return msgpack.packb(interests)
+    if fmt not in FORMATS:
+        raise ValueError('Unknown interests format: %s' % fmt)
+    return codec.dumps(interests)
+
+
+def decode(data):
+    """Returns interests list from data of any format, [] for empty data"""
+    if not data:
+        return []
+    if isinstance(data, bytes) and data[0] == COMPACT_MARKER:
+        return list(_decode_compact(data))
+    fmt = detect(data)
+    if fmt == COMPACT:
+        return list(_decode_compact(bytes(data)))
+    if fmt == MSGPACK:
+        if msgpack is None:
+            raise ValueError('msgpack is not installed')
+        return msgpack.unpackb(data)
+    return codec.loads(data)
+
+
+def migrate_keys(client, keys, fmt):
+    """Re-encodes values of keys to fmt keeping their ttl. Keys are watched,
+    the batch is re-read if any of them is changed meanwhile. Returns
+    (converted, failed) numbers"""
+    with client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(*keys)
+                values = pipe.mget(keys)
+                pipe.multi()
+                converted = failed = 0
+                for key, value in zip(keys, values):
+                    if value is None or detect(value) == fmt:
+                        continue
+                    try:
+                        encoded = encode(decode(value), fmt)
+                    except ValueError as e:
+                        logging.error("Can't decode %s: %s", key, e)
+                        failed += 1
+                        continue
+                    if encoded == value:
+                        continue
+                    pipe.set(key, encoded, keepttl=True)
+                    converted += 1
+                pipe.execute()
+                return converted, failed
+            except redis.WatchError:
+                continue
+
+
+def _batches(keys, size):
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def migrate(client, fmt, match='i:*', batch_size=500):
+    """Re-encodes all keys matching pattern to fmt. Returns (scanned,
+    converted, failed) numbers"""
+    scanned = converted = failed = 0
+    for batch in _batches(client.scan_iter(match=match, count=batch_size),
+                          batch_size):
+        batch_converted, batch_failed = migrate_keys(client, batch, fmt)
+        scanned += len(batch)
+        converted += batch_converted
+        failed += batch_failed
+    return scanned, converted, failed
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-f", "--format", action="store", type="choice",
+                  choices=list(FORMATS), default=COMPACT)
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--match", action="store", default="i:*")
+    op.add_option("--batch-size", action="store", type=int, default=500)
+    (opts, args) = op.parse_args()
+    from scoring_api.api import LOG_FORMAT, LOG_DATE_FORMAT
+    logging.basicConfig(format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT,
+                        level=logging.INFO)
+    result = migrate(redis.Redis(host=opts.redis_host, port=opts.redis_port),
+                     opts.format, opts.match, max(opts.batch_size, 1))
+    logging.info("Scanned %s keys, converted %s, failed %s", *result)
@@ -0,0 +1,275 @@
+"""In-process metrics rendered in Prometheus text format. Every metric keeps
+its values per tuple of label values, updates take one lock and a dict
+lookup so they are cheap enough for every request.
+Processes serving the same port, like prefork workers, share() a directory
+to which each one writes its values, render() then reports the sum of all
+of them"""
+import abc
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(metaclass=abc.ABCMeta):
+    type_ = 'untyped'
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """Returns copy of values"""
+        with self.lock:
+            return dict(self.values)
+
+    @abc.abstractmethod
+    def combine(self, values, others):
+        """Returns (label names, values) for values of this process and
+        list of (pid, alive, values) of other processes"""
+
+    @abc.abstractmethod
+    def samples(self, values):
+        """Yields (name suffix, label values, extra labels, value)"""
+
+    def render(self, others=()):
+        labels, values = self.labels, self.snapshot()
+        if others:
+            labels, values = self.combine(values, others)
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.type_)]
+        for suffix, label_values, extra, value in self.samples(values):
+            lines.append('%s%s%s %s' % (
+                self.name, suffix,
+                _format_labels(labels, label_values, extra),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = (self.values.get(label_values, 0) +
+                                         amount)
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def combine(self, values, others):
+        # values of exited processes are kept, so sums never go back
+        for _, _, other in others:
+            for label_values, value in other.items():
+                values[label_values] = values.get(label_values, 0) + value
+        return self.labels, values
+
+    def samples(self, values):
+        for label_values, value in sorted(values.items()):
+            yield '', label_values, (), value
+
+
+class Gauge(Counter):
+    """Gauge of a process, with shared values it is reported per process
+    with pid label and only for running processes"""
+    type_ = 'gauge'
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def combine(self, values, others):
+        combined = {label_values + (str(os.getpid()),): value
+                    for label_values, value in values.items()}
+        for pid, alive, other in others:
+            if alive:
+                for label_values, value in other.items():
+                    combined[label_values + (str(pid),)] = value
+        return self.labels + ('pid',), combined
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, *label_values):
+        state = self.values.get(label_values)
+        return sum(state[0]) if state else 0
+
+    def snapshot(self):
+        with self.lock:
+            return {label_values: [list(counts), total]
+                    for label_values, (counts, total) in self.values.items()}
+
+    def combine(self, values, others):
+        for _, _, other in others:
+            for label_values, (counts, total) in other.items():
+                state = values.get(label_values)
+                if state is None:
+                    values[label_values] = [list(counts), total]
+                    continue
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+        return self.labels, values
+
+    def samples(self, values):
+        for label_values, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = (('le', _format_value(bound)),)
+                yield '_bucket', label_values, le, cumulative
+            yield '_sum', label_values, (), total
+            yield '_count', label_values, (), cumulative
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.path = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def share(self, directory, interval=1.0):
+        """Writes values of this process to a file in directory every
+        interval seconds from a daemon thread and makes render() add values
+        written there by other processes. Files are named <pid>-<start>.json,
+        so a process reusing pid of an exited one doesn't overwrite it"""
+        self.path = os.path.join(directory, '%s-%s.json' % (
+            os.getpid(), time.time_ns()))
+        self.write()
+        thread = threading.Thread(target=self._write_forever,
+                                  args=(interval,), daemon=True)
+        thread.start()
+
+    def _write_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.write()
+            except OSError as e:
+                logging.error("Failed to write metrics: %s", e)
+
+    def write(self):
+        """Writes values of this process to its file in shared directory"""
+        values = {metric.name: [[list(label_values), value] for
+                                label_values, value in
+                                metric.snapshot().items()]
+                  for metric in self.metrics}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(values, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def read_shared(self):
+        """Returns dict of metric name to list of (pid, alive, values) of
+        other processes sharing the directory"""
+        shared = {}
+        directory = os.path.dirname(self.path)
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            pid = filename.split('-', 1)[0]
+            if (not filename.endswith('.json') or not pid.isdigit() or
+                    path == self.path):
+                continue
+            try:
+                with open(path) as f:
+                    values = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _alive(int(pid))
+            for name, items in values.items():
+                shared.setdefault(name, []).append((int(pid), alive, {
+                    tuple(label_values): value
+                    for label_values, value in items}))
+        return shared
+
+    def render(self):
+        shared = self.read_shared() if self.path else {}
+        return '\n'.join(metric.render(shared.get(metric.name, ()))
+                         for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_, labels=()):
+    return REGISTRY.register(Counter(name, help_, labels))
+
+
+def gauge(name, help_, labels=()):
+    return REGISTRY.register(Gauge(name, help_, labels))
+
+
+def histogram(name, help_, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_, labels, buckets))
+
+
+def share(directory, interval=1.0):
+    REGISTRY.share(directory, interval)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,115 @@
+"""Profiling of selected requests with cProfile. Stats are aggregated per
+method and either dumped to pstats files or logged as text summary"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+
+PROFILE_HEADER = "X-Profile"
+
+
+class Profiler(object):
+    """Runs request handlers under cProfile. A request is profiled if it is
+    sampled with `rate` or carries PROFILE_HEADER equal to `token`. Only one
+    request is profiled at a time, requests selected meanwhile run as usual.
+    Args:
+        rate: share of requests to profile.
+        token: value of PROFILE_HEADER which turns profiling on for the
+            request, header is ignored if None.
+        output_dir: directory for pstats files, stats are logged as text if
+            None.
+        dump_every: number of profiled requests of a method after which its
+            stats are dumped, 0 to dump only on dump() call.
+        limit: number of functions in text summary."""
+
+    def __init__(self, rate=0.0, token=None, output_dir=None, dump_every=100,
+                 limit=30):
+        self.rate = rate
+        self.token = token
+        self.output_dir = output_dir
+        self.dump_every = dump_every
+        self.limit = limit
+        self.stats = {}
+        self.counts = {}
+        self.running = threading.Lock()
+        self.lock = threading.Lock()
+
+    def authorized(self, headers):
+        """True if headers carry the configured token"""
+        if self.token is None:
+            return False
+        value = headers.get(PROFILE_HEADER)
+        return value is not None and hmac.compare_digest(
+            value.encode('utf-8'), self.token.encode('utf-8'))
+
+    def wanted(self, headers):
+        """True if the request is to be profiled"""
+        return (self.authorized(headers) or self.rate >= 1 or
+                random.random() < self.rate)
+
+    def call(self, handler, request, ctx, store):
+        """Calls handler(request, ctx, store) under profiler, stats are
+        accounted to ctx['method']"""
+        if not self.running.acquire(blocking=False):
+            return handler(request, ctx, store)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                return handler(request, ctx, store)
+            finally:
+                profile.disable()
+        finally:
+            self.running.release()
+            self.add(ctx.get('method', 'none'), profile)
+
+    def add(self, method, profile):
+        with self.lock:
+            stats = self.stats.get(method)
+            if stats is None:
+                self.stats[method] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self.counts[method] = count = self.counts.get(method, 0) + 1
+            if (self.output_dir and self.dump_every and
+                    count % self.dump_every == 0):
+                self._dump_file(method)
+
+    def path(self, method):
+        # workers of prefork server write their own files
+        return os.path.join(self.output_dir, "%s.%s.pstats" %
+                            (method, os.getpid()))
+
+    def _dump_file(self, method):
+        self.stats[method].dump_stats(self.path(method))
+
+    def summary(self, method=None):
+        """Returns text summary of stats of method or of all methods sorted
+        by cumulative time"""
+        with self.lock:
+            methods = [method] if method is not None else sorted(self.stats)
+            parts = []
+            for name in methods:
+                if name not in self.stats:
+                    continue
+                out = io.StringIO()
+                stats = self.stats[name]
+                stream, stats.stream = stats.stream, out
+                stats.sort_stats('cumulative').print_stats(self.limit)
+                stats.stream = stream
+                parts.append("%s: %s requests\n%s" %
+                             (name, self.counts[name], out.getvalue()))
+            return "\n".join(parts)
+
+    def dump(self):
+        """Writes stats of all methods to output_dir or to log"""
+        if self.output_dir:
+            with self.lock:
+                for method in self.stats:
+                    self._dump_file(method)
+        elif self.stats:
+            logging.info("Request profile:\n%s", self.summary())
@@ -0,0 +1,185 @@
+"""Replays method requests from JSONL file against running server and reports
+throughput, latency percentiles and response codes per method:
+
+    python -m scoring_api.replay -i requests.jsonl -c 16 -n 100000
+    python -m scoring_api.replay -i requests.jsonl -r 2000 -d 60
+
+With `-c` every worker sends next request as soon as previous one is
+answered. With `-r` requests are scheduled at fixed rate and latency is
+counted from the scheduled time, so server stalls are not hidden by workers
+waiting for responses"""
+import http.client
+import itertools
+import json
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(int(-(-q * len(values) // 100)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def request_method(body):
+    if isinstance(body, list):
+        return 'batch'
+    if isinstance(body, dict):
+        return str(body.get('method'))
+    return 'unknown'
+
+
+def load_requests(infile):
+    """Returns list of (method, encoded body) for non-empty lines"""
+    requests = []
+    for line in infile:
+        line = line.strip()
+        if line:
+            try:
+                method = request_method(json.loads(line))
+            except ValueError:
+                method = 'unknown'
+            requests.append((method, line))
+    return requests
+
+
+class Recorder(object):
+    def __init__(self):
+        self.latencies = {}
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, code, latency):
+        with self.lock:
+            self.latencies.setdefault(method, []).append(latency)
+            codes = self.codes.setdefault(method, {})
+            codes[code] = codes.get(code, 0) + 1
+
+    def report(self, elapsed):
+        methods = {}
+        total = 0
+        for method in sorted(self.latencies):
+            latencies = sorted(self.latencies[method])
+            total += len(latencies)
+            methods[method] = {
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed if elapsed else 0,
+                "latency_ms": {str(q): percentile(latencies, q) * 1000
+                               for q in PERCENTILES},
+                "codes": {str(code): count for code, count
+                          in sorted(self.codes[method].items(),
+                                    key=lambda item: str(item[0]))},
+            }
+        return {"requests": total, "elapsed": elapsed,
+                "rps": total / elapsed if elapsed else 0,
+                "methods": methods}
+
+
+def replay(address, requests, concurrency=8, rate=None, total=None,
+           duration=None, path='/method/', timeout=10,
+           clock=time.perf_counter):
+    """Sends requests cyclically from `concurrency` threads until `total`
+    requests are sent or `duration` seconds pass, once through requests if
+    neither is given. With `rate` requests are sent at fixed rate by the
+    same threads. Returns report dict"""
+    if total is None and duration is None:
+        total = len(requests)
+    schedule = itertools.count()
+    schedule_lock = threading.Lock()
+    recorder = Recorder()
+    started = clock()
+    deadline = started + duration if duration is not None else None
+
+    def next_request():
+        with schedule_lock:
+            index = next(schedule)
+        if total is not None and index >= total:
+            return None, None
+        scheduled = started + index / rate if rate else clock()
+        if deadline is not None and scheduled >= deadline:
+            return None, None
+        return requests[index % len(requests)], scheduled
+
+    def worker():
+        conn = http.client.HTTPConnection(*address, timeout=timeout)
+        try:
+            while True:
+                request, scheduled = next_request()
+                if request is None:
+                    return
+                method, body = request
+                delay = scheduled - clock()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    conn.request('POST', path, body)
+                    response = conn.getresponse()
+                    response.read()
+                    code = response.status
+                    if response.getheader('Connection', '') == 'close':
+                        conn.close()
+                except (OSError, http.client.HTTPException) as e:
+                    code = type(e).__name__
+                    conn.close()
+                recorder.record(method, code, clock() - scheduled)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(clock() - started)
+
+
+def format_report(report):
+    lines = ["%d requests in %.2fs, %.1f req/s" % (
+        report["requests"], report["elapsed"], report["rps"])]
+    header = "%-20s %8s %9s" % ("method", "requests", "req/s") + "".join(
+        " %9s" % ("p%s ms" % q) for q in PERCENTILES) + "  codes"
+    lines.append(header)
+    for method, stats in report["methods"].items():
+        lines.append("%-20s %8d %9.1f" % (method, stats["requests"],
+                                          stats["rps"]) +
+                     "".join(" %9.2f" % stats["latency_ms"][str(q)]
+                             for q in PERCENTILES) +
+                     "  " + " ".join("%s:%s" % item
+                                     for item in stats["codes"].items()))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-i", "--input", action="store", default="requests.jsonl")
+    op.add_option("-H", "--host", action="store", default="localhost")
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("--path", action="store", default="/method/")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=8)
+    op.add_option("-r", "--rate", action="store", type=float, default=None,
+                  help="requests per second, as fast as possible if unset")
+    op.add_option("-n", "--requests", action="store", type=int, default=None)
+    op.add_option("-d", "--duration", action="store", type=float,
+                  default=None, help="seconds to send requests for")
+    op.add_option("-t", "--timeout", action="store", type=float, default=10)
+    op.add_option("-o", "--output", action="store", default=None,
+                  help="file to write json report to")
+    (opts, args) = op.parse_args()
+    with open(opts.input, "rb") as infile:
+        requests = load_requests(infile)
+    if not requests:
+        sys.exit("no requests in %s" % opts.input)
+    report = replay((opts.host, opts.port), requests,
+                    concurrency=max(opts.concurrency, 1), rate=opts.rate,
+                    total=opts.requests, duration=opts.duration,
+                    path=opts.path, timeout=opts.timeout)
+    print(format_report(report))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,9 +1,49 @@
 import hashlib
-import json
+
+from scoring_api import interests
+from scoring_api import metrics
+from scoring_api.store import SingleFlight, AsyncSingleFlight, TTLCache
+
+SCORE_CACHE = metrics.counter(
+    'scoring_score_cache_total', 'Score cache lookups by result',
+    ('result',))
+ABSENT_INTERESTS_HITS = metrics.counter(
+    'scoring_absent_interests_hits_total',
+    'Interests lookups answered by the cache of absent keys')
+SCORE_FIELDS = ('phone', 'email', 'birthday', 'gender', 'first_name',
+                'last_name')
+SCORE_TTL = 60 * 60
+SCORE_KEY_VERSION = "v2"
+# read scores cached with _legacy_score_key if there is none under the
+# current key, for rollover of the key scheme
+READ_LEGACY_KEYS = False
+# concurrent lookups of the same key in the same store share one call,
+# stores are told apart by their id
+SCORE_FLIGHTS = SingleFlight('score')
+INTEREST_FLIGHTS = SingleFlight('interests')
+ASYNC_SCORE_FLIGHTS = AsyncSingleFlight('score')
+ASYNC_INTEREST_FLIGHTS = AsyncSingleFlight('interests')
+# i:<cid> keys read as absent are not read again for ABSENT_INTERESTS_TTL
+# seconds, 0 disables it. Writers of this process call forget_absent_interests
+ABSENT_INTERESTS_TTL = 0
+ABSENT_INTERESTS = TTLCache(max_size=100000)
 
 
 def _score_key(phone, email, birthday=None, gender=None, first_name=None,
                last_name=None):
+    """Key of cached score. Missing values are normalized and the tuple repr
+    is hashed, so every field takes part and fields can't run into each
+    other"""
+    canonical = (str(phone or ""), email or "", birthday or "", gender or 0,
+                 first_name or "", last_name or "")
+    to_hash = repr(canonical).encode('UTF-8')
+    return "uid:%s:%s" % (SCORE_KEY_VERSION,
+                          hashlib.blake2b(to_hash, digest_size=16).hexdigest())
+
+
+def _legacy_score_key(phone, email, birthday=None, gender=None,
+                      first_name=None, last_name=None):
+    """Key of the previous scheme, it ignores email and gender"""
     key_parts = [
         first_name or "",
         last_name or "",
@@ -14,14 +54,18 @@ def _score_key(phone, email, birthday=None, gender=None, first_name=None,
     return "uid:" + hashlib.md5(to_hash).hexdigest()
 
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
-              last_name=None):
-    key = _score_key(phone, email, birthday, gender, first_name, last_name)
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = float(store.cache_get(key) or 0)
-    if score:
-        return score
+def score_cache_keys(phone, email, birthday=None, gender=None,
+                     first_name=None, last_name=None):
+    """Cache keys get_score may read"""
+    args = (phone, email, birthday, gender, first_name, last_name)
+    if READ_LEGACY_KEYS:
+        return [_score_key(*args), _legacy_score_key(*args)]
+    return [_score_key(*args)]
+
+
+def _compute_score(phone, email, birthday=None, gender=None, first_name=None,
+                   last_name=None):
+    score = 0.0
     if phone:
         score += 1.5
     if email:
@@ -30,11 +74,208 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
+    return score
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
+              last_name=None):
+    key = _score_key(phone, email, birthday, gender, first_name, last_name)
+    return SCORE_FLIGHTS.do(key, lambda: _get_score(
+        store, key, phone, email, birthday, gender, first_name, last_name),
+        id(store))
+
+
+def _get_score(store, key, phone, email, birthday, gender, first_name,
+               last_name):
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+    score = float(store.cache_get(key) or 0)
+    if not score and READ_LEGACY_KEYS:
+        score = float(store.cache_get(_legacy_score_key(
+            phone, email, birthday, gender, first_name, last_name)) or 0)
+        if score:
+            store.cache_set(key, score, SCORE_TTL)
+    if score:
+        SCORE_CACHE.inc('hit')
+        return score
+    SCORE_CACHE.inc('miss')
+    score = _compute_score(phone, email, birthday, gender, first_name,
+                           last_name)
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set(key, score, SCORE_TTL)
     return score
 
 
+def _record_values(record):
+    return tuple(record.get(name) for name in SCORE_FIELDS)
+
+
+def _legacy_misses(rows, cached):
+    """Returns (index, legacy key) of rows without cached score"""
+    return [(i, _legacy_score_key(*rows[i]))
+            for i, val in enumerate(cached) if not float(val or 0)]
+
+
+def _merge_legacy(keys, cached, misses, legacy):
+    """Puts scores found by legacy keys to cached, returns them by current
+    keys to be written to cache"""
+    migrated = {}
+    for (i, _), val in zip(misses, legacy):
+        if float(val or 0):
+            cached[i] = val
+            migrated[keys[i]] = float(val)
+    return migrated
+
+
+def _score_misses(rows, keys, cached):
+    """Returns scores with cached values and scores to write to cache"""
+    scores = [float(val or 0) for val in cached]
+    misses = [i for i, score in enumerate(scores) if not score]
+    SCORE_CACHE.inc('hit', amount=len(scores) - len(misses))
+    SCORE_CACHE.inc('miss', amount=len(misses))
+    for i in misses:
+        scores[i] = _compute_score(*rows[i])
+    return scores, {keys[i]: scores[i] for i in misses}
+
+
+def get_scores(store, records):
+    """get_score for many records with SCORE_FIELDS keys. Cached scores are
+    read with one store.cache_get_many call and computed ones are written
+    with one store.cache_set_many call. Returns scores in records order"""
+    rows = [_record_values(record) for record in records]
+    keys = [_score_key(*row) for row in rows]
+    cached = list(store.cache_get_many(keys))
+    migrated = {}
+    if READ_LEGACY_KEYS:
+        misses = _legacy_misses(rows, cached)
+        if misses:
+            legacy = store.cache_get_many([key for _, key in misses])
+            migrated = _merge_legacy(keys, cached, misses, legacy)
+    scores, to_cache = _score_misses(rows, keys, cached)
+    to_cache.update(migrated)
+    if to_cache:
+        store.cache_set_many(to_cache, SCORE_TTL)
+    return scores
+
+
+def _interests_key(cid):
+    return "i:%s" % cid
+
+
+def forget_absent_interests(cids):
+    """Drops cids from the cache of absent keys, to be called after their
+    interests are written"""
+    for cid in cids:
+        ABSENT_INTERESTS.pop(_interests_key(cid))
+
+
+def unknown_interests_keys(keys):
+    """Returns keys which are not known to be absent"""
+    if ABSENT_INTERESTS_TTL <= 0:
+        return keys
+    unknown = [key for key in keys if ABSENT_INTERESTS.get(key) is None]
+    if len(unknown) < len(keys):
+        ABSENT_INTERESTS_HITS.inc(amount=len(keys) - len(unknown))
+    return unknown
+
+
+def _remember_absent(keys, unknown, values):
+    """Updates the cache of absent keys with values read for unknown keys,
+    returns values for all keys"""
+    if ABSENT_INTERESTS_TTL <= 0:
+        return values
+    for key, value in zip(unknown, values):
+        if value is None:
+            ABSENT_INTERESTS.set(key, True, ABSENT_INTERESTS_TTL)
+        else:
+            ABSENT_INTERESTS.pop(key)
+    if len(unknown) == len(keys):
+        return values
+    found = dict(zip(unknown, values))
+    return [found.get(key) for key in keys]
+
+
 def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    key = _interests_key(cid)
+    if ABSENT_INTERESTS_TTL > 0 and not unknown_interests_keys([key]):
+        return []
+    r = INTEREST_FLIGHTS.do(key, lambda: store.get(key), id(store))
+    if ABSENT_INTERESTS_TTL > 0:
+        _remember_absent([key], [key], [r])
+    return interests.decode(r)
+
+
+def get_interests_many(store, cids):
+    """Returns interests for every cid in one store.get_many call"""
+    keys = [_interests_key(cid) for cid in cids]
+    unknown = unknown_interests_keys(keys)
+    values = _remember_absent(keys, unknown, INTEREST_FLIGHTS.do_many(
+        unknown, store.get_many, id(store)))
+    return [interests.decode(r) for r in values]
+
+
+async def get_score_async(store, phone, email, birthday=None, gender=None,
+                          first_name=None, last_name=None):
+    """get_score for AsyncStore"""
+    key = _score_key(phone, email, birthday, gender, first_name, last_name)
+    return await ASYNC_SCORE_FLIGHTS.do(key, lambda: _get_score_async(
+        store, key, phone, email, birthday, gender, first_name, last_name),
+        id(store))
+
+
+async def _get_score_async(store, key, phone, email, birthday, gender,
+                           first_name, last_name):
+    score = float(await store.cache_get(key) or 0)
+    if not score and READ_LEGACY_KEYS:
+        score = float(await store.cache_get(_legacy_score_key(
+            phone, email, birthday, gender, first_name, last_name)) or 0)
+        if score:
+            await store.cache_set(key, score, SCORE_TTL)
+    if score:
+        SCORE_CACHE.inc('hit')
+        return score
+    SCORE_CACHE.inc('miss')
+    score = _compute_score(phone, email, birthday, gender, first_name,
+                           last_name)
+    await store.cache_set(key, score, SCORE_TTL)
+    return score
+
+
+async def get_scores_async(store, records):
+    """get_scores for AsyncStore"""
+    rows = [_record_values(record) for record in records]
+    keys = [_score_key(*row) for row in rows]
+    cached = list(await store.cache_get_many(keys))
+    migrated = {}
+    if READ_LEGACY_KEYS:
+        misses = _legacy_misses(rows, cached)
+        if misses:
+            legacy = await store.cache_get_many([key for _, key in misses])
+            migrated = _merge_legacy(keys, cached, misses, legacy)
+    scores, to_cache = _score_misses(rows, keys, cached)
+    to_cache.update(migrated)
+    if to_cache:
+        await store.cache_set_many(to_cache, SCORE_TTL)
+    return scores
+
+
+async def get_interests_async(store, cid):
+    """get_interests for AsyncStore"""
+    key = _interests_key(cid)
+    if ABSENT_INTERESTS_TTL > 0 and not unknown_interests_keys([key]):
+        return []
+    r = await ASYNC_INTEREST_FLIGHTS.do(key, lambda: store.get(key),
+                                        id(store))
+    if ABSENT_INTERESTS_TTL > 0:
+        _remember_absent([key], [key], [r])
+    return interests.decode(r)
+
+
+async def get_interests_many_async(store, cids):
+    """get_interests_many for AsyncStore"""
+    keys = [_interests_key(cid) for cid in cids]
+    unknown = unknown_interests_keys(keys)
+    values = _remember_absent(
+        keys, unknown, await ASYNC_INTEREST_FLIGHTS.do_many(
+            unknown, store.get_many, id(store)))
+    return [interests.decode(r) for r in values]
@@ -1,7 +1,152 @@
 import abc
+import asyncio
+import functools
+import logging
+import queue
+import threading
 import time
+from collections import OrderedDict
 
 import redis
+import redis.asyncio
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+from redis.asyncio.retry import Retry as AsyncRetry
+
+from scoring_api import metrics
+
+REDIS_LATENCY = metrics.histogram(
+    'scoring_redis_command_seconds', 'Latency of redis command attempts',
+    ('command',))
+REDIS_ERRORS = metrics.counter(
+    'scoring_redis_errors_total', 'Redis connection and timeout errors',
+    ('command',))
+REDIS_RETRIES = metrics.counter(
+    'scoring_redis_retries_total', 'Redis commands retried after an error')
+REDIS_RECONNECTS = metrics.counter(
+    'scoring_redis_reconnects_total', 'Redis store reconnects')
+REDIS_REJECTED = metrics.counter(
+    'scoring_redis_rejected_total',
+    'Redis commands failed fast by open circuit breaker', ('command',))
+BREAKER_STATE = metrics.gauge(
+    'scoring_redis_breaker_state',
+    'Circuit breaker state: 0 closed, 1 open, 2 half open')
+BREAKER_TRANSITIONS = metrics.counter(
+    'scoring_redis_breaker_transitions_total',
+    'Circuit breaker state changes by new state', ('state',))
+SINGLEFLIGHT_SHARED = metrics.counter(
+    'scoring_singleflight_shared_total',
+    'Lookups served by a concurrent in-flight call for the same key',
+    ('name',))
+
+
+class CircuitBreaker(object):
+    """Stops calls to a failing backend. After `failure_threshold`
+    consecutive failures it opens and rejects calls for `reset_timeout`
+    seconds, then lets one probe call through in half open state. Success
+    of the probe closes it, failure opens it again. Listeners are called
+    with (old state, new state) on every change."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=1.0,
+                 clock=time.monotonic):
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _set_state(self, state):
+        """Must be called with lock held, returns listener calls to make
+        after releasing it"""
+        old, self.state = self.state, state
+        return [(listener, old, state) for listener in self.listeners]
+
+    def _notify(self, calls):
+        for listener, old, state in calls:
+            try:
+                listener(old, state)
+            except Exception:
+                logging.exception("Circuit breaker listener failed")
+
+    def allow(self):
+        """Returns whether a call may be made now. Allowed calls should be
+        followed by success() or failure(), a probe which never reports is
+        replaced by another one after reset_timeout"""
+        allowed, calls = False, []
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            if now - self.opened_at >= self.reset_timeout:
+                allowed, self.opened_at = True, now
+                if self.state == self.OPEN:
+                    calls = self._set_state(self.HALF_OPEN)
+        self._notify(calls)
+        return allowed
+
+    def success(self):
+        calls = []
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                calls = self._set_state(self.CLOSED)
+        self._notify(calls)
+
+    def failure(self):
+        calls = []
+        with self.lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self.state == self.CLOSED and
+                    self.failures >= self.failure_threshold):
+                self.opened_at = self.clock()
+                calls = self._set_state(self.OPEN)
+        self._notify(calls)
+
+
+class _BlockingConnectionPool(redis.BlockingConnectionPool):
+    """Pool of at most max_connections waiting up to timeout for a free
+    one. Raises MaxConnectionsError when none is freed, so a busy pool is
+    not taken for failing redis"""
+    def get_connection(self, *args, **kwargs):
+        try:
+            return super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if isinstance(e.__context__, queue.Empty):
+                raise redis.MaxConnectionsError(str(e)) from e
+            raise
+
+
+class _AsyncBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+    """_BlockingConnectionPool for asyncio"""
+    async def get_connection(self, *args, **kwargs):
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if isinstance(e.__context__, asyncio.TimeoutError):
+                raise redis.MaxConnectionsError(str(e)) from e
+            raise
+
+
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.OPEN: 1,
+                  CircuitBreaker.HALF_OPEN: 2}
+
+
+def report_breaker_state(old, state):
+    """Breaker listener updating metrics and log"""
+    BREAKER_STATE.set(BREAKER_STATES[state])
+    BREAKER_TRANSITIONS.inc(state)
+    log = logging.info if state == CircuitBreaker.CLOSED else logging.warning
+    log("Redis circuit breaker %s -> %s", old, state)
 
 
 class Store(metaclass=abc.ABCMeta):
@@ -17,54 +162,718 @@ class Store(metaclass=abc.ABCMeta):
     def cache_set(key, val, sec):
         pass
 
+    def get_many(self, keys):
+        """Returns list of values for keys, None for missing ones"""
+        return [self.get(key) for key in keys]
+
+    def cache_get_many(self, keys):
+        return [self.cache_get(key) for key in keys]
+
+    def cache_set_many(self, items, sec):
+        """Args:
+            items: dict of key to value, all cached for sec seconds"""
+        for key, val in items.items():
+            self.cache_set(key, val, sec)
+
 
-class RedisStore(Store):
+class _RedisStoreBase(object):
+    """Configuration, circuit breaker and metrics of RedisStore and
+    AsyncRedisStore, which differ only in I/O. Arguments are described in
+    RedisStore"""
+    connection_pool_class = redis.ConnectionPool
+    blocking_pool_class = _BlockingConnectionPool
+    client_class = redis.Redis
+    retry_class = Retry
 
     def __init__(self, host='localhost', port=6379, client_builder=None,
-                 attempts=3, timeout=5):
+                 attempts=3, timeout=5, connect_timeout=None, pool_size=None,
+                 keepalive=True, health_check_interval=30, chunk_size=100,
+                 retry_backoff=0.01, breaker=None):
         self.host = host
         self.port = port
+        self.chunk_size = max(int(chunk_size), 1)
         attempts = int(attempts)
         self.attempts = attempts if attempts > 0 else 1
         timeout = int(timeout)
         self.timeout = timeout if timeout > 0 else None
-        self.sleep_time = 3
+        self.connect_timeout = connect_timeout or self.timeout
+        self.retry_backoff = retry_backoff
+        if breaker is None:
+            breaker = CircuitBreaker()
+            breaker.add_listener(report_breaker_state)
+        self.breaker = breaker
+        self.pool = None
         if not client_builder:
+            if pool_size:
+                pool_cls = functools.partial(self.blocking_pool_class,
+                                             timeout=self.timeout)
+            else:
+                pool_cls = self.connection_pool_class
+            self.pool = pool_cls(
+                host=self.host, port=self.port, max_connections=pool_size,
+                socket_timeout=self.timeout,
+                socket_connect_timeout=self.connect_timeout,
+                socket_keepalive=keepalive,
+                health_check_interval=health_check_interval,
+                # retries are handled by the store itself
+                retry=self.retry_class(NoBackoff(), 0))
+
             def def_builder():
-                return redis.Redis(host=self.host, port=self.port,
-                                   socket_timeout=self.timeout)
+                return self.client_class(connection_pool=self.pool)
             client_builder = def_builder
         self.client_builder = client_builder
         self.client = self.client_builder()
 
-    def _get_client(self):
+    def _new_client(self):
+        self.client = self.client_builder()
+        REDIS_RECONNECTS.inc()
+
+    def _allow(self, command):
+        if not self.breaker.allow():
+            REDIS_REJECTED.inc(command)
+            raise redis.ConnectionError("Circuit breaker is open")
+
+    def _failed(self, command, started, attempt, retries):
+        """Records attempt failed with connection error. Returns seconds to
+        wait before the next attempt or None if there is none"""
+        REDIS_LATENCY.observe(time.perf_counter() - started, command)
+        REDIS_ERRORS.inc(command)
+        self.breaker.failure()
+        if attempt >= retries:
+            return None
+        REDIS_RETRIES.inc()
+        return self.retry_backoff * 2 ** attempt
+
+    def _succeeded(self, command, started):
+        REDIS_LATENCY.observe(time.perf_counter() - started, command)
+        self.breaker.success()
+
+    def _chunks(self, keys):
+        """Splits keys into MGET commands of at most chunk_size keys"""
+        keys = list(keys)
+        return [('mget', keys[i:i + self.chunk_size])
+                for i in range(0, len(keys), self.chunk_size)]
+
+    @staticmethod
+    def _setex_commands(items, sec):
+        return [('setex', key, sec, val) for key, val in items.items()]
+
+
+class RedisStore(_RedisStoreBase, Store):
+    """Redis backed store. Commands share a connection pool and are sent
+    without preliminary PING: idle connections are health-checked by the pool
+    every health_check_interval seconds and the store reconnects only after
+    a command fails with a connection error, up to `attempts` times for get
+    and get_many. Cache operations are tried once. Failures are counted by
+    circuit breaker, while it is open commands fail at once with
+    redis.ConnectionError, so cache operations don't wait for redis.
+    Args:
+        pool_size: max number of pooled connections, unlimited if None.
+            Commands wait up to timeout for a free connection and then fail
+            with redis.MaxConnectionsError, which is not counted as redis
+            failure.
+        timeout: socket timeout in seconds.
+        connect_timeout: connect timeout in seconds, timeout if None.
+        keepalive: enable TCP keepalive on pooled sockets.
+        health_check_interval: seconds of idleness after which a connection
+            is checked before use.
+        chunk_size: max number of keys in one MGET of get_many.
+        retry_backoff: seconds before the first retry, doubled for every
+            next one.
+        breaker: CircuitBreaker, new one with defaults if None."""
+
+    def _reconnect(self):
+        if self.pool is not None:
+            # drop idle sockets, failed ones are closed by redis-py itself
+            self.pool.disconnect(inuse_connections=False)
+        self._new_client()
+
+    def _call(self, func, command, retries=None):
+        retries = self.attempts if retries is None else retries
         attempt = 0
         while True:
+            self._allow(command)
+            started = time.perf_counter()
             try:
-                self.client.ping()
-                break
-            except redis.ConnectionError:
-                if attempt >= self.attempts:
+                result = func(self.client)
+            except redis.MaxConnectionsError:
+                # every connection of the pool is busy, redis is fine
+                raise
+            except (redis.ConnectionError, redis.TimeoutError):
+                delay = self._failed(command, started, attempt, retries)
+                if delay is None:
                     raise
-                time.sleep(self.sleep_time)
-                self.client = self.client_builder()
+                time.sleep(delay)
+                self._reconnect()
                 attempt += 1
-        return self.client
+            except Exception:
+                # redis answered or the error is local
+                self.breaker.success()
+                raise
+            else:
+                self._succeeded(command, started)
+                return result
+
+    def _execute(self, command, *args, retries=None):
+        return self._call(lambda client: getattr(client, command)(*args),
+                          command, retries)
+
+    def _execute_pipeline(self, commands, retries=None):
+        """Sends list of (command, *args) in one round-trip"""
+        def run(client):
+            pipe = client.pipeline(transaction=False)
+            for command, *args in commands:
+                getattr(pipe, command)(*args)
+            return pipe.execute()
+        return self._call(run, 'pipeline', retries)
 
     def get(self, key):
-        client = self._get_client()
-        return client.get(key)
+        return self._execute('get', key)
+
+    def get_many(self, keys, retries=None):
+        values = []
+        for command in self._chunks(keys):
+            values.extend(self._execute(*command, retries=retries))
+        return values
 
+    # cache operations are tried once, a cache miss is cheaper than waiting
+    # for retries against unavailable redis
     def cache_get(self, key):
         try:
-            client = self._get_client()
-            return client.get(key)
+            return self._execute('get', key, retries=0)
         except redis.RedisError:
             return None
 
     def cache_set(self, key, val, sec):
         try:
-            client = self._get_client()
-            client.setex(key, sec, val)
+            self._execute('setex', key, sec, val, retries=0)
+        except redis.RedisError:
+            pass
+
+    def cache_get_many(self, keys):
+        try:
+            return self.get_many(keys, retries=0)
+        except redis.RedisError:
+            return [None] * len(keys)
+
+    def cache_set_many(self, items, sec):
+        try:
+            self._execute_pipeline(self._setex_commands(items, sec),
+                                   retries=0)
+        except redis.RedisError:
+            pass
+
+
+class _PrefetchedStoreBase(object):
+    """State of PrefetchedStore and AsyncPrefetchedStore"""
+
+    def __init__(self, store, values=None, cache_values=None):
+        self.store = store
+        self.values = dict(values or {})
+        self.cache_values = dict(cache_values or {})
+        self.pending = {}
+
+    def _missed(self, keys):
+        return [key for key in keys if key not in self.values]
+
+    def _buffer(self, key, val, sec):
+        self.cache_values[key] = val
+        self.pending.setdefault(sec, {})[key] = val
+
+    def _take_pending(self):
+        """Returns buffered cache_set calls as dict of ttl to items"""
+        pending, self.pending = self.pending, {}
+        return pending
+
+
+class PrefetchedStore(_PrefetchedStoreBase, Store):
+    """View of a store with preloaded values. Reads of preloaded keys don't
+    touch the store and cache_set calls are buffered until flush, so a
+    batch of requests costs a few round-trips"""
+
+    def get(self, key):
+        if key not in self.values:
+            self.values[key] = self.store.get(key)
+        return self.values[key]
+
+    def get_many(self, keys):
+        missed = self._missed(keys)
+        if missed:
+            self.values.update(zip(missed, self.store.get_many(missed)))
+        return [self.values[key] for key in keys]
+
+    def cache_get(self, key):
+        if key not in self.cache_values:
+            return self.store.cache_get(key)
+        return self.cache_values[key]
+
+    def cache_set(self, key, val, sec):
+        self._buffer(key, val, sec)
+
+    def flush(self):
+        """Writes buffered cache_set calls, one cache_set_many per ttl"""
+        for sec, items in self._take_pending().items():
+            self.store.cache_set_many(items, sec)
+
+
+class TTLCache(object):
+    """Thread safe LRU mapping of bounded size with per-entry expiration.
+    Counts hits, misses and evictions of live entries"""
+    _missing = object()
+
+    def __init__(self, max_size=1024, clock=time.monotonic):
+        self.max_size = max(int(max_size), 1)
+        self.clock = clock
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key, self._missing)
+            if item is not self._missing:
+                val, expires = item
+                if expires > self.clock():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return val
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, val, ttl):
+        with self.lock:
+            if ttl <= 0:
+                self.data.pop(key, None)
+                return
+            self.data[key] = (val, self.clock() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, self._missing)
+            return default if item is self._missing else item[0]
+
+    def stats(self):
+        return {"size": len(self.data), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class _Call(object):
+    """Call of SingleFlight registered under keys. value is the result of
+    func for a call of do and (list of keys, list of values) for a call of
+    do_many, indexed by the first waiter reading it. done is created only
+    when another caller waits for the call"""
+    __slots__ = ('keys', 'scope', 'many', 'finished', 'value', 'error',
+                 'done', 'index')
+
+    def __init__(self, keys, scope, many=False):
+        self.keys = keys
+        self.scope = scope
+        self.many = many
+        self.finished = False
+        self.value = None
+        self.error = None
+        self.done = None
+        self.index = None
+
+    def result(self, key):
+        if self.error is not None:
+            raise self.error
+        if not self.many:
+            return self.value
+        if self.index is None:
+            self.index = dict(zip(*self.value))
+        return self.index[key]
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key: the first caller runs
+    the call, callers arriving while it is in flight wait for it and get its
+    result or exception. Nothing is kept after the call returns. Calls of
+    different scopes, like different stores, are not shared.
+    The caller running the call takes no lock: flights are added and removed
+    with atomic dict operations, the lock only guards creation of done by
+    waiters. The caller sets finished before it looks at done and waiters
+    look at finished after they set done, so no waiter is left behind"""
+    def __init__(self, name='default'):
+        self.name = name
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def _waiter(self):
+        return threading.Event()
+
+    def _wait_for(self, call):
+        """Makes sure call sets done when it finishes"""
+        with self.lock:
+            if call.done is None:
+                call.done = self._waiter()
+
+    def _join(self, call, other):
+        """Returns (call, True) for a call the caller has to run or
+        (other, False) for the call in flight to wait for"""
+        if other.scope != call.scope:
+            # in flight for another store, run it without sharing
+            call.keys = ()
+            return call, True
+        SINGLEFLIGHT_SHARED.inc(self.name)
+        self._wait_for(other)
+        return other, False
+
+    def _join_many(self, keys, scope):
+        """Registers a call under keys which are not in flight. Returns
+        (call, fetch, owners, others): fetch are keys to get with the call,
+        owners map keys in flight to the calls which get them and others
+        are those calls to wait for"""
+        call = _Call(None, scope, many=True)
+        unique = dict.fromkeys(keys)
+        setdefault = self.flights.setdefault
+        owners = {}
+        for key in unique:
+            other = setdefault(key, call)
+            if other is not call:
+                owners[key] = other
+        if not owners:
+            call.keys = list(unique)
+            return call, call.keys, owners, ()
+        call.keys = [key for key in unique if key not in owners]
+        fetch, others = list(call.keys), {}
+        for key, other in list(owners.items()):
+            if other.scope != scope:
+                # in flight for another store, get it without sharing
+                del owners[key]
+                fetch.append(key)
+            elif other not in others:
+                self._wait_for(other)
+                others[other] = None
+        if owners:
+            SINGLEFLIGHT_SHARED.inc(self.name, amount=len(owners))
+        return call, fetch, owners, others
+
+    def _land(self, call):
+        for key in call.keys:
+            del self.flights[key]
+        call.finished = True
+        if call.done is not None:
+            call.done.set()
+
+    def do(self, key, func, scope=None):
+        """Returns func() or result of the same call already in flight"""
+        call = _Call((key,), scope)
+        other = self.flights.setdefault(key, call)
+        if other is not call:
+            call, leader = self._join(call, other)
+        else:
+            leader = True
+        if leader:
+            try:
+                call.value = func()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._land(call)
+            return call.value
+        if not call.finished:
+            call.done.wait()
+        return call.result(key)
+
+    def do_many(self, keys, func, scope=None):
+        """Returns list of values of list of keys. Keys in flight in other
+        calls are shared, the rest is got with one func(list of keys) call
+        registered under every one of them. Every caller gets its own list"""
+        call, fetch, owners, others = self._join_many(keys, scope)
+        values = []
+        if fetch:
+            try:
+                values = func(fetch)
+                call.value = fetch, values
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._land(call)
+        for other in others:
+            if not other.finished:
+                other.done.wait()
+        return _many_result(keys, call, fetch, values, owners)
+
+
+def _many_result(keys, call, fetch, values, owners):
+    """Returns values of keys for do_many, values are got for fetch by
+    call and for the rest by their owners"""
+    if not owners and len(fetch) == len(keys):
+        return list(values)
+    return [owners.get(key, call).result(key) for key in keys]
+
+
+class CachingStore(Store):
+    """In-process cache in front of another store's cache_get/cache_set.
+    Entries live as long as cache_set asked for, values read through from
+    the wrapped store are kept for fill_ttl seconds. get and get_many are
+    passed through untouched.
+    Args:
+        store: wrapped Store.
+        max_size: max number of entries kept in process.
+        fill_ttl: ttl for values found in wrapped store, 0 to not keep
+            them."""
+    _missing = object()
+
+    def __init__(self, store, max_size=10000, fill_ttl=60):
+        self.store = store
+        self.fill_ttl = fill_ttl
+        self.cache = TTLCache(max_size)
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def get_many(self, keys):
+        return self.store.get_many(keys)
+
+    def cache_get(self, key):
+        val = self.cache.get(key, self._missing)
+        if val is not self._missing:
+            return val
+        val = self.store.cache_get(key)
+        if val is not None and self.fill_ttl:
+            self.cache.set(key, val, self.fill_ttl)
+        return val
+
+    def cache_set(self, key, val, sec):
+        self.cache.set(key, val, sec)
+        self.store.cache_set(key, val, sec)
+
+    def cache_get_many(self, keys):
+        values = [self.cache.get(key, self._missing) for key in keys]
+        missed = [key for key, val in zip(keys, values)
+                  if val is self._missing]
+        if not missed:
+            return values
+        fetched = dict(zip(missed, self.store.cache_get_many(missed)))
+        if self.fill_ttl:
+            for key, val in fetched.items():
+                if val is not None:
+                    self.cache.set(key, val, self.fill_ttl)
+        return [fetched[key] if val is self._missing else val
+                for key, val in zip(keys, values)]
+
+    def cache_set_many(self, items, sec):
+        for key, val in items.items():
+            self.cache.set(key, val, sec)
+        self.store.cache_set_many(items, sec)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class AsyncStore(metaclass=abc.ABCMeta):
+    """Store interface for asyncio code, all methods are coroutines"""
+    @abc.abstractmethod
+    async def get(self, key):
+        pass
+
+    @abc.abstractmethod
+    async def cache_get(self, key):
+        pass
+
+    @abc.abstractmethod
+    async def cache_set(self, key, val, sec):
+        pass
+
+    async def get_many(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def cache_get_many(self, keys):
+        return [await self.cache_get(key) for key in keys]
+
+    async def cache_set_many(self, items, sec):
+        for key, val in items.items():
+            await self.cache_set(key, val, sec)
+
+
+class AsyncRedisStore(_RedisStoreBase, AsyncStore):
+    """asyncio version of RedisStore with the same pooling and retry
+    behaviour"""
+    connection_pool_class = redis.asyncio.ConnectionPool
+    blocking_pool_class = _AsyncBlockingConnectionPool
+    client_class = redis.asyncio.Redis
+    retry_class = AsyncRetry
+
+    async def _reconnect(self):
+        if self.pool is not None:
+            await self.pool.disconnect(inuse_connections=False)
+        self._new_client()
+
+    async def _call(self, func, command, retries=None):
+        retries = self.attempts if retries is None else retries
+        attempt = 0
+        while True:
+            self._allow(command)
+            started = time.perf_counter()
+            try:
+                result = await func(self.client)
+            except redis.MaxConnectionsError:
+                raise
+            except (redis.ConnectionError, redis.TimeoutError):
+                delay = self._failed(command, started, attempt, retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                await self._reconnect()
+                attempt += 1
+            except Exception:
+                self.breaker.success()
+                raise
+            else:
+                self._succeeded(command, started)
+                return result
+
+    async def _execute(self, command, *args, retries=None):
+        return await self._call(
+            lambda client: getattr(client, command)(*args), command, retries)
+
+    async def _execute_pipeline(self, commands, retries=None):
+        async def run(client):
+            pipe = client.pipeline(transaction=False)
+            for command, *args in commands:
+                getattr(pipe, command)(*args)
+            return await pipe.execute()
+        return await self._call(run, 'pipeline', retries)
+
+    async def get(self, key):
+        return await self._execute('get', key)
+
+    async def get_many(self, keys, retries=None):
+        values = []
+        for command in self._chunks(keys):
+            values.extend(await self._execute(*command, retries=retries))
+        return values
+
+    async def cache_get(self, key):
+        try:
+            return await self._execute('get', key, retries=0)
+        except redis.RedisError:
+            return None
+
+    async def cache_set(self, key, val, sec):
+        try:
+            await self._execute('setex', key, sec, val, retries=0)
         except redis.RedisError:
             pass
+
+    async def cache_get_many(self, keys):
+        try:
+            return await self.get_many(keys, retries=0)
+        except redis.RedisError:
+            return [None] * len(keys)
+
+    async def cache_set_many(self, items, sec):
+        try:
+            await self._execute_pipeline(self._setex_commands(items, sec),
+                                         retries=0)
+        except redis.RedisError:
+            pass
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines of one event loop"""
+    def _waiter(self):
+        done = asyncio.get_running_loop().create_future()
+        # waiters get errors themselves, don't log them as unused
+        done.add_done_callback(_retrieve_exception)
+        return done
+
+    def _land(self, call):
+        for key in call.keys:
+            del self.flights[key]
+        call.finished = True
+        done = call.done
+        if done is None:
+            return
+        if call.error is None:
+            done.set_result(None)
+        elif isinstance(call.error, Exception):
+            done.set_exception(call.error)
+        else:
+            # the call was cancelled, waiters are cancelled too
+            done.cancel()
+
+    async def do(self, key, func, scope=None):
+        """Returns await func() or result of the same call in flight"""
+        call = _Call((key,), scope)
+        other = self.flights.setdefault(key, call)
+        if other is not call:
+            call, leader = self._join(call, other)
+        else:
+            leader = True
+        if leader:
+            try:
+                call.value = await func()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._land(call)
+            return call.value
+        if not call.finished:
+            await asyncio.shield(call.done)
+        return call.result(key)
+
+    async def do_many(self, keys, func, scope=None):
+        """SingleFlight.do_many with await func(list of keys)"""
+        call, fetch, owners, others = self._join_many(keys, scope)
+        values = []
+        if fetch:
+            try:
+                values = await func(fetch)
+                call.value = fetch, values
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._land(call)
+        for other in others:
+            if not other.finished:
+                await asyncio.shield(other.done)
+        return _many_result(keys, call, fetch, values, owners)
+
+
+def _retrieve_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncPrefetchedStore(_PrefetchedStoreBase, AsyncStore):
+    """PrefetchedStore for asyncio code"""
+
+    async def get(self, key):
+        if key not in self.values:
+            self.values[key] = await self.store.get(key)
+        return self.values[key]
+
+    async def get_many(self, keys):
+        missed = self._missed(keys)
+        if missed:
+            self.values.update(zip(missed, await self.store.get_many(missed)))
+        return [self.values[key] for key in keys]
+
+    async def cache_get(self, key):
+        if key not in self.cache_values:
+            return await self.store.cache_get(key)
+        return self.cache_values[key]
+
+    async def cache_set(self, key, val, sec):
+        self._buffer(key, val, sec)
+
+    async def flush(self):
+        for sec, items in self._take_pending().items():
+            await self.store.cache_set_many(items, sec)
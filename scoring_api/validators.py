@@ -1,92 +1,196 @@
+"""Validator factories. Every validator raises ValueError or TypeError on
+invalid value and returns True otherwise. Its `check` attribute is the same
+validation without exceptions: it returns error code or None"""
 import datetime
+import functools
+import time
+
 from dateutil.relativedelta import relativedelta
 
 
+def validator(check, message, error=ValueError):
+    """Makes raising validator from check function.
+    Args:
+        check: callable returning error code for invalid value, else None.
+        message: callable building exception message from value.
+        error: exception type."""
+    def validate(val):
+        if check(val) is not None:
+            raise error(message(val))
+        return True
+    validate.check = check
+    return validate
+
+
+def as_check(validate):
+    """Returns non-raising check for any validator"""
+    check = getattr(validate, 'check', None)
+    if check is not None:
+        return check
+
+    def check_raising(val):
+        try:
+            validate(val)
+        except Exception:
+            return 'invalid'
+    return check_raising
+
+
 def has_length(length):
     if length <= 0:
         raise ValueError('Length must be positive int')
     length = int(length)
 
-    def valdiate_length(val):
-        cur_length = len(str(val))
-        if cur_length != length:
-            raise ValueError('Incorrect length. Expected {}, but got {}'
-                             .format(length, cur_length))
-        else:
-            return True
-    return valdiate_length
+    def check_length(val):
+        if len(str(val)) != length:
+            return 'length'
+
+    def message(val):
+        return ('Incorrect length. Expected {}, but got {}'
+                .format(length, len(str(val))))
+    return validator(check_length, message)
 
 
 def starts_with(char):
     char = str(char)
 
-    def validate_prefix(val):
-        first = str(val)[0]
-        if first != char:
-            raise ValueError('Incorrect prefix. Expected {}, but got {}'
-                             .format(char, first))
-        else:
-            return True
-    return validate_prefix
+    def check_prefix(val):
+        if not str(val).startswith(char):
+            return 'prefix'
 
+    def message(val):
+        return ('Incorrect prefix. Expected {}, but got {}'
+                .format(char, str(val)[:1]))
+    return validator(check_prefix, message)
+
+
+def _check_if_email(val):
+    if not isinstance(val, str) or '@' not in val:
+        return 'email'
+
+
+check_if_email = validator(_check_if_email,
+                           lambda val: 'There is no @ in email field')
+
+
+DATE_CACHE_SIZE = 4096
 
-def check_if_email(val):
-    if '@' not in val:
-        raise ValueError('There is no @ in email field')
-    else:
-        return True
+
+def _parse_dmy(val):
+    """Parses zero-padded %d.%m.%Y date without strptime, None if val has
+    other shape"""
+    if (len(val) != 10 or val[2] != '.' or val[5] != '.' or
+            not val.isascii()):
+        return None
+    day, month, year = val[:2], val[3:5], val[6:]
+    if not (day.isdigit() and month.isdigit() and year.isdigit()):
+        return None
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date_cached(val, fmt):
+    if fmt == '%d.%m.%Y':
+        date = _parse_dmy(val)
+        if date is not None:
+            return date
+    try:
+        return datetime.datetime.strptime(val, fmt).date()
+    except ValueError:
+        return None
+
+
+def _parse_date(val, fmt):
+    """Returns date parsed from val or None. Results are cached, zero-padded
+    %d.%m.%Y dates are parsed without strptime"""
+    if not isinstance(val, str):
+        return None
+    return _parse_date_cached(val, fmt)
+
+
+class AgeCutoff(object):
+    """Latest birthday of someone older than `years` today. It is computed
+    once and reused until the next day begins"""
+    def __init__(self, years, clock=time.time):
+        self.years = years
+        self.clock = clock
+        self.current = (0, None)
+
+    def get(self):
+        expires, cutoff = self.current
+        now = self.clock()
+        if now >= expires:
+            today = datetime.date.fromtimestamp(now)
+            cutoff = today - relativedelta(years=self.years + 1)
+            expires = datetime.datetime.combine(
+                today + datetime.timedelta(days=1),
+                datetime.time()).timestamp()
+            self.current = (expires, cutoff)
+        return cutoff
 
 
 def is_date(fmt):
     if not isinstance(fmt, str):
         raise ValueError('Format must be string')
 
-    def valdiate_date(val):
-        datetime.datetime.strptime(val, fmt)
-        return True
+    def check_date(val):
+        if _parse_date(val, fmt) is None:
+            return 'date'
 
-    return valdiate_date
+    def message(val):
+        return 'Value {!r} does not match format {}'.format(val, fmt)
+    return validator(check_date, message)
 
 
-def is_age_le(years, fmt):
+def is_age_le(years, fmt, clock=time.time):
     years = int(years)
     if years <= 0:
         raise ValueError('Length must be positive int')
+    cutoff = AgeCutoff(years, clock)
 
-    def validate_age(val):
-        bday = datetime.datetime.strptime(val, fmt)
-        now = datetime.datetime.now()
-        if relativedelta(now, bday).years > years:
-            raise ValueError('Age is bigger then {}'.format(years))
-        else:
-            return True
-    return validate_age
+    def check_age(val):
+        bday = _parse_date(val, fmt)
+        if bday is None:
+            return 'date'
+        if bday <= cutoff.get():
+            return 'age'
+
+    def message(val):
+        if _parse_date(val, fmt) is None:
+            return 'Value {!r} does not match format {}'.format(val, fmt)
+        return 'Age is bigger then {}'.format(years)
+    return validator(check_age, message)
 
 
 def int_in_range(range_):
-    def validate_int_in_range(val):
+    def check_int_in_range(val):
         if val not in range_:
-            raise ValueError('Value: {} not in range'.format(val))
-        else:
-            return True
-    return validate_int_in_range
+            return 'range'
+
+    def message(val):
+        return 'Value: {} not in range'.format(val)
+    return validator(check_int_in_range, message)
 
 
 def check_type(type_):
-    def validate_type(val):
+    def check_value_type(val):
         if not isinstance(val, type_):
-            raise TypeError('value must be instance of any of {}'
-                            .format(str(type_)))
-        else:
-            return True
-    return validate_type
+            return 'type'
+
+    def message(val):
+        return 'value must be instance of any of {}'.format(str(type_))
+    return validator(check_value_type, message, TypeError)
 
 
 def item_has_type(type_):
-    def validate_items_type(val):
+    def check_items_type(val):
         for item in val:
             if not isinstance(item, type_):
-                raise TypeError('value must be instance of any of {}'
-                                .format(str(type_)))
-        return True
-    return validate_items_type
+                return 'item_type'
+
+    def message(val):
+        return 'value must be instance of any of {}'.format(str(type_))
+    return validator(check_items_type, message, TypeError)
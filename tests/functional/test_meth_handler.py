@@ -2,8 +2,11 @@ import hashlib
 import datetime
 import functools
 import unittest
+from unittest import mock
 
-from scoring_api import api
+import fakeredis
+
+from scoring_api import api, scoring, store
 from tests.utils import cases
 
 
@@ -16,6 +19,9 @@ class TestSuite(unittest.TestCase):
             def get(self, key):
                 return '["some", "other"]'
 
+            def get_many(self, keys):
+                return [self.get(key) for key in keys]
+
             def cache_get(self, key):
                 return None
 
@@ -40,6 +46,14 @@ class TestSuite(unittest.TestCase):
         _, code = self.get_response({})
         self.assertEqual(api.INVALID_REQUEST, code)
 
+    def test_unknown_method(self):
+        request = {"account": "horns&hoofs", "login": "h&f",
+                   "method": "unknown", "arguments": {}}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(code, api.NOT_FOUND)
+        self.assertEqual(response, "Unknown method - unknown")
+
     @cases([
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}},
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "sdd", "arguments": {}},
@@ -82,6 +96,18 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(api.INVALID_REQUEST, code, arguments)
         self.assertTrue(len(response))
 
+    def test_invalid_request_reasons(self):
+        arguments = {"phone": "89175002040", "email": "stupnikov@otus.ru",
+                     "gender": 5}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code)
+        self.assertEqual(self.context["errors"], {"phone": "prefix", "gender": "range"})
+        self.assertEqual(api.make_response(response, code, self.context["errors"]),
+                         {"error": "invalid fields: phone, gender", "code": code,
+                          "fields": {"phone": "prefix", "gender": "range"}})
+
     @cases([
         {"phone": "79175002040", "email": "stupnikov@otus.ru"},
         {"phone": 79175002040, "email": "stupnikov@otus.ru"},
@@ -141,5 +167,148 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
 
+class TestBatchSuite(unittest.TestCase):
+    def setUp(self):
+        self.context = {}
+
+        class StoreMock(object):
+            def __init__(self):
+                self.calls = []
+                self.cache = {}
+
+            def get(self, key):
+                self.calls.append('get')
+                return '["some", "other"]'
+
+            def get_many(self, keys):
+                self.calls.append('get_many')
+                return ['["some", "other"]' for key in keys]
+
+            def cache_get(self, key):
+                self.calls.append('cache_get')
+                return None
+
+            def cache_get_many(self, keys):
+                self.calls.append('cache_get_many')
+                return [self.cache.get(key) for key in keys]
+
+            def cache_set(self, key, val, sec):
+                self.calls.append('cache_set')
+
+            def cache_set_many(self, items, sec):
+                self.calls.append('cache_set_many')
+                self.cache.update(items)
+
+        self.store = StoreMock()
+
+    def get_response(self, request):
+        return api.method_handler({"body": request, "headers": {}},
+                                  self.context, self.store)
+
+    def make_item(self, login, method, arguments):
+        item = {"account": "horns&hoofs", "login": login, "method": method,
+                "arguments": arguments}
+        item["token"] = api.digestize(api.MethodRequest(item))
+        return item
+
+    def test_batch(self):
+        batch = [
+            self.make_item("h&f", "online_score",
+                           {"phone": "79175002040", "email": "a@b"}),
+            self.make_item("h&f", "online_score",
+                           {"first_name": "a", "last_name": "b"}),
+            self.make_item("admin", "online_score",
+                           {"phone": "79175002040", "email": "a@b"}),
+            self.make_item("h&f", "clients_interests", {"client_ids": [1, 2]}),
+            self.make_item("h&f", "online_score", {"phone": "79175002040"}),
+            dict(self.make_item("h&f", "online_score", {}), token="bad"),
+            "not an object",
+        ]
+        response, code = self.get_response(batch)
+        self.assertEqual(code, api.OK)
+        self.assertEqual([r["code"] for r in response],
+                         [api.OK, api.OK, api.OK, api.OK,
+                          api.INVALID_REQUEST, api.FORBIDDEN,
+                          api.BAD_REQUEST])
+        self.assertEqual(response[0]["response"], {"score": 3})
+        self.assertEqual(response[1]["response"], {"score": 0.5})
+        self.assertEqual(response[2]["response"], {"score": 42})
+        self.assertEqual(response[3]["response"],
+                         {1: ["some", "other"], 2: ["some", "other"]})
+        self.assertTrue(response[4]["error"])
+        self.assertEqual(len(self.context["batch"]), len(batch))
+        self.assertEqual(self.context["batch"][3]["nclients"], 2)
+        self.assertEqual(sorted(self.store.calls),
+                         ['cache_get_many', 'cache_set_many', 'get_many'])
+
+    def test_batch_uses_cached_scores(self):
+        batch = [self.make_item("h&f", "online_score",
+                                {"phone": "79175002040", "email": "a@b"})]
+        self.get_response(batch)
+        self.store.cache = {key: -1 for key in self.store.cache}
+        response, code = self.get_response(batch)
+        self.assertEqual(response[0]["response"], {"score": -1})
+
+    def test_batch_reads_legacy_scores(self):
+        arguments = {"phone": "79175002040", "email": "a@b"}
+        batch = [self.make_item("h&f", "online_score", arguments)]
+        legacy_key = scoring._legacy_score_key(**arguments)
+        self.store.cache = {legacy_key: -1}
+        with mock.patch.object(scoring, 'READ_LEGACY_KEYS', True):
+            response, code = self.get_response(batch)
+        self.assertEqual(response[0]["response"], {"score": -1})
+        self.assertEqual(self.store.cache[scoring._score_key(**arguments)],
+                         -1)
+        self.assertNotIn('cache_get', self.store.calls)
+
+    def test_batch_prefetches_valid_items_only(self):
+        batch = [
+            self.make_item("h&f", "clients_interests", {"client_ids": [1]}),
+            dict(self.make_item("h&f", "clients_interests",
+                                {"client_ids": list(range(2, 1000))}),
+                 token="bad"),
+            self.make_item("h&f", "clients_interests", {"client_ids": "x"}),
+        ]
+        with mock.patch.object(self.store, 'get_many',
+                               wraps=self.store.get_many) as get_many:
+            response, code = self.get_response(batch)
+        get_many.assert_called_once_with(["i:1"])
+        self.assertEqual([item["code"] for item in response],
+                         [api.OK, api.FORBIDDEN, api.INVALID_REQUEST])
+
+    def test_batch_size_limit(self):
+        item = self.make_item("h&f", "online_score",
+                              {"phone": "79175002040", "email": "a@b"})
+        with mock.patch.object(api, 'MAX_BATCH_SIZE', 2):
+            _, code = self.get_response([item, item])
+            self.assertEqual(code, api.OK)
+            _, code = self.get_response([item, item, item])
+            self.assertEqual(code, api.INVALID_REQUEST)
+
+    def test_batch_with_store_down(self):
+        server = fakeredis.FakeServer()
+        server.connected = False
+        self.store = store.RedisStore(
+            attempts=0, client_builder=lambda: fakeredis.FakeStrictRedis(
+                server=server))
+        batch = [
+            self.make_item("h&f", "online_score",
+                           {"phone": "79175002040", "email": "a@b"}),
+            self.make_item("h&f", "clients_interests", {"client_ids": [1]}),
+        ]
+        response, code = self.get_response(batch)
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response, [
+            {"response": {"score": 3.0}, "code": api.OK},
+            {"error": api.ERRORS[api.INTERNAL_ERROR],
+             "code": api.INTERNAL_ERROR},
+        ])
+
+    def test_empty_batch(self):
+        response, code = self.get_response([])
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response, [])
+
+
 if __name__ == "__main__":
     unittest.main()
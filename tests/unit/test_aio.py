@@ -0,0 +1,205 @@
+import asyncio
+import json
+import unittest
+
+import fakeredis
+
+from scoring_api import aio, api, store
+
+
+class AsyncStoreMock(object):
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        return '["some", "other"]'
+
+    async def get_many(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def cache_get(self, key):
+        return self.store.get(key)
+
+    async def cache_set(self, key, val, sec):
+        self.store[key] = val
+
+    async def cache_get_many(self, keys):
+        return [await self.cache_get(key) for key in keys]
+
+    async def cache_set_many(self, items, sec):
+        self.store.update(items)
+
+
+def make_request(login, method, arguments):
+    request = {"account": "horns&hoofs", "login": login, "method": method,
+               "arguments": arguments}
+    request["token"] = api.digestize(api.MethodRequest(request))
+    return request
+
+
+class TestAsyncMethodHandler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = AsyncStoreMock()
+        self.context = {}
+
+    async def get_response(self, request):
+        return await aio.method_handler({"body": request, "headers": {}},
+                                        self.context, self.store)
+
+    async def test_empty_request(self):
+        _, code = await self.get_response({})
+        self.assertEqual(code, api.INVALID_REQUEST)
+
+    async def test_bad_auth(self):
+        request = make_request("h&f", "online_score", {})
+        request["token"] = "bad"
+        _, code = await self.get_response(request)
+        self.assertEqual(code, api.FORBIDDEN)
+
+    async def test_ok_score_request(self):
+        for arguments, expected in [
+            ({"phone": "79175002040", "email": "stupnikov@otus.ru"}, 3),
+            ({"first_name": "a", "last_name": "b"}, 0.5),
+        ]:
+            request = make_request("h&f", "online_score", arguments)
+            response, code = await self.get_response(request)
+            self.assertEqual(code, api.OK, arguments)
+            self.assertEqual(response["score"], expected)
+            self.assertEqual(sorted(self.context["has"]), sorted(arguments))
+
+    async def test_invalid_score_request(self):
+        request = make_request("h&f", "online_score", {"phone": "7"})
+        response, code = await self.get_response(request)
+        self.assertEqual(code, api.INVALID_REQUEST)
+        self.assertTrue(len(response))
+
+    async def test_ok_interests_request(self):
+        request = make_request("h&f", "clients_interests",
+                               {"client_ids": [1, 2, 3]})
+        response, code = await self.get_response(request)
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response, {cid: ["some", "other"]
+                                    for cid in [1, 2, 3]})
+        self.assertEqual(self.context["nclients"], 3)
+
+    async def test_batch(self):
+        batch = [
+            make_request("h&f", "online_score",
+                         {"phone": "79175002040", "email": "a@b"}),
+            make_request("h&f", "clients_interests", {"client_ids": [1]}),
+            make_request("h&f", "online_score", {}),
+        ]
+        response, code = await self.get_response(batch)
+        self.assertEqual(code, api.OK)
+        self.assertEqual(response[0], {"response": {"score": 3},
+                                       "code": api.OK})
+        self.assertEqual(response[1], {"response": {1: ["some", "other"]},
+                                       "code": api.OK})
+        self.assertEqual(response[2]["code"], api.INVALID_REQUEST)
+        self.assertEqual(list(self.store.store.values()), [3])
+
+    async def test_batch_with_store_down(self):
+        server = fakeredis.FakeServer()
+        server.connected = False
+        self.store = store.AsyncRedisStore(
+            attempts=0, client_builder=lambda: fakeredis.FakeAsyncRedis(
+                server=server))
+        batch = [
+            make_request("h&f", "online_score",
+                         {"phone": "79175002040", "email": "a@b"}),
+            make_request("h&f", "clients_interests", {"client_ids": [1]}),
+        ]
+        response, code = await self.get_response(batch)
+        self.assertEqual(code, api.OK)
+        self.assertEqual([item["code"] for item in response],
+                         [api.OK, api.INTERNAL_ERROR])
+        self.assertEqual(response[0]["response"], {"score": 3})
+
+    async def test_unknown_method(self):
+        request = make_request("h&f", "unknown", {})
+        _, code = await self.get_response(request)
+        self.assertEqual(code, api.NOT_FOUND)
+
+
+class TestAsyncHTTPServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = aio.AsyncHTTPServer(AsyncStoreMock(), port=0)
+        await self.server.start()
+        self.port = self.server.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.server.close()
+        await self.server.server.wait_closed()
+
+    async def post(self, reader, writer, path, body):
+        payload = json.dumps(body).encode('UTF-8')
+        writer.write(b"POST %s HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Length: %d\r\n\r\n%s"
+                     % (path.encode(), len(payload), payload))
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        status = int(head.split(b" ")[1])
+        length = [int(line.split(b":")[1]) for line in head.split(b"\r\n")
+                  if line.lower().startswith(b"content-length")][0]
+        return status, json.loads(await reader.readexactly(length))
+
+    async def test_keep_alive(self):
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        request = make_request("admin", "online_score",
+                               {"phone": "79175002040", "email": "a@b"})
+        for _ in range(3):
+            status, body = await self.post(reader, writer, "/method/",
+                                           request)
+            self.assertEqual(status, api.OK)
+            self.assertEqual(body, {"response": {"score": 42},
+                                    "code": api.OK})
+        writer.close()
+
+    async def test_not_found(self):
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        status, body = await self.post(reader, writer, "/unknown/", {"a": 1})
+        self.assertEqual(status, api.NOT_FOUND)
+        writer.close()
+
+    async def test_metrics(self):
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        await self.post(reader, writer, "/unknown/", {"a": 1})
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        self.assertTrue(head.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b"Content-Type: text/plain", head)
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        text = (await reader.readexactly(length)).decode('utf-8')
+        self.assertIn('scoring_requests_total{method="none",code="404"}',
+                      text)
+        writer.close()
+
+    async def test_empty_batch(self):
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        status, body = await self.post(reader, writer, "/method/", [])
+        self.assertEqual((status, body), (api.OK, {"response": [],
+                                                   "code": api.OK}))
+        writer.close()
+
+    async def test_body_timeout(self):
+        self.server.keepalive_timeout = 0.1
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        writer.write(b"POST /method/ HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Length: 100\r\n\r\n{")
+        await writer.drain()
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b"")
+        writer.close()
+
+    async def test_body_too_large(self):
+        reader, writer = await asyncio.open_connection('localhost', self.port)
+        writer.write(b"POST /method/ HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Length: %d\r\n\r\n"
+                     % (self.server.max_body_size + 1))
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+        self.assertTrue(head.startswith(b"HTTP/1.1 400"))
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,20 @@
 import unittest
 import functools
-
-from scoring_api import api
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import tempfile
+import threading
+import time
+import http.client
+from unittest import mock
+
+from scoring_api import api, profiling
 from tests.utils import cases
 
 
@@ -332,6 +345,57 @@ class TestRequest(unittest.TestCase):
         with self.assertRaises(Exception):
             c.validate()
 
+    def test_fields_built_with_class(self):
+        class C(api.Request):
+            char_field = api.CharField(required=True, nullable=False)
+            phone_field = api.PhoneField(required=True, nullable=True,
+                                         length=5, prefix=1)
+
+            def validate(self):
+                return super().validate()
+
+        class D(C):
+            opt_char_field = api.CharField(required=False, nullable=False)
+            phone_field = None
+
+        self.assertEqual([name for name, _ in C.fields],
+                         ['char_field', 'phone_field'])
+        self.assertEqual([name for name, _ in D.fields],
+                         ['char_field', 'opt_char_field'])
+        self.assertEqual(C({}).fields, C.fields)
+        D(dict(char_field='a')).validate()
+        with self.assertRaises(Exception):
+            D(dict(char_field='a', opt_char_field='')).validate()
+
+    def test_compact(self):
+        class C(api.Request, compact=True):
+            char_field = api.CharField(required=True, nullable=False)
+            opt_char_field = api.CharField(required=False, nullable=False)
+
+            def validate(self):
+                return super().validate()
+
+        c = C(dict(char_field='a', unknown='b'))
+        self.assertFalse(hasattr(c, '__dict__'))
+        self.assertFalse(hasattr(c, 'unknown'))
+        self.assertEqual(c.char_field, 'a')
+        self.assertIsNone(c.opt_char_field)
+        self.assertEqual(c.as_dict(), dict(char_field='a',
+                                           opt_char_field=None))
+        c.validate()
+        with self.assertRaises(Exception):
+            C(dict(unknown='b')).validate()
+
+    def test_not_compact_keeps_unknown_keys(self):
+        class C(api.Request):
+            char_field = api.CharField(required=True, nullable=False)
+
+            def validate(self):
+                return super().validate()
+
+        c = C(dict(char_field='a', unknown='b'))
+        self.assertEqual(c.unknown, 'b')
+
 
 class TestRequestsSuite(unittest.TestCase):
     @cases([
@@ -388,6 +452,32 @@ class TestRequestsSuite(unittest.TestCase):
         req_obj = api.OnlineScoreRequest(request)
         self.assertEqual(sorted(req_obj.has), sorted(request.keys()))
 
+    @cases([
+        ({"phone": "7917500204", "email": "bb", "gender": 3,
+          "birthday": "01.01.1900", "first_name": 1},
+         {"phone": "length", "email": "email", "gender": "range",
+          "birthday": "age", "first_name": "type"}),
+        ({"phone": "89175002040", "birthday": "1.1.20000"},
+         {"phone": "prefix", "birthday": "date"}),
+        ({"phone": "79175002040"}, {api.NON_FIELD_ERRORS: "no_field_pairs"}),
+        ({"phone": "79175002040", "email": "a@b"}, {}),
+    ])
+    def test_online_score_request_check(self, request, errors):
+        req_obj = api.OnlineScoreRequest(request)
+        self.assertEqual(req_obj.check(), errors)
+
+    def test_check_message(self):
+        req_obj = api.OnlineScoreRequest({"phone": "79175002040"})
+        self.assertEqual(req_obj.error_message(req_obj.check()),
+                         "There is no available field pairs")
+        req_obj = api.MethodRequest({"login": 1})
+        self.assertEqual(req_obj.check(), {"login": "type",
+                                           "token": "required",
+                                           "arguments": "required",
+                                           "method": "required"})
+        self.assertEqual(req_obj.error_message(req_obj.check()),
+                         "invalid fields: login, token, arguments, method")
+
     @cases([
         {"client_ids": [1]},
         {"client_ids": [1, 2]},
@@ -416,5 +506,377 @@ class TestRequestsSuite(unittest.TestCase):
         self.assertEqual(req_obj.nclients, len(ids))
 
 
+class TestAuth(unittest.TestCase):
+    def test_admin_digest_rolls_over_hourly(self):
+        now = datetime.datetime(2017, 7, 20, 10, 59, 59).timestamp()
+        clock = [now]
+        digest = api.HourlyDigest(api.ADMIN_SALT, clock=lambda: clock[0])
+
+        def expected(hour):
+            msg = hour + api.ADMIN_SALT
+            return hashlib.sha512(msg.encode('UTF-8')).hexdigest()
+        self.assertEqual(digest.get(), expected("2017072010"))
+        with mock.patch('hashlib.sha512') as sha512:
+            digest.get()
+            self.assertFalse(sha512.called)
+        clock[0] = now + 1
+        self.assertEqual(digest.get(), expected("2017072011"))
+
+    def test_user_digest_cached(self):
+        api.user_digest.cache_clear()
+        request = api.MethodRequest({"account": "a", "login": "b"})
+        msg = "a" + "b" + api.SALT
+        expected = hashlib.sha512(msg.encode('UTF-8')).hexdigest()
+        self.assertEqual(api.digestize(request), expected)
+        self.assertEqual(api.digestize(request), expected)
+        self.assertEqual(api.user_digest.cache_info().hits, 1)
+
+    @cases([
+        (None, False),
+        (1, False),
+        ("", False),
+        ("\u0444", False),
+        ("valid", True),
+    ])
+    def test_check_auth(self, token, expected):
+        request = {"account": "a", "login": "b", "token": token}
+        if token == "valid":
+            request["token"] = api.digestize(api.MethodRequest(request))
+        self.assertEqual(api.check_auth(api.MethodRequest(request)),
+                         expected)
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self.addCleanup(setattr, root, 'handlers', root.handlers[:])
+        self.addCleanup(root.setLevel, root.level)
+
+    def test_setup_logging(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log')
+            listener = api.setup_logging(path)
+            handler = logging.getLogger().handlers[0]
+            self.assertIsInstance(handler, api.DeferredQueueHandler)
+            logging.info("value %s", 42)
+            listener.stop()
+            with open(path) as f:
+                self.assertIn('I value 42', f.read())
+
+    def test_full_queue(self):
+        handler = api.DeferredQueueHandler(queue.Queue(maxsize=1))
+        record = logging.makeLogRecord({"msg": "%s", "args": (1,)})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(handler.dropped, 1)
+        self.assertIs(handler.queue.get_nowait(), record)
+
+
+class TestThreadPoolHTTPServer(unittest.TestCase):
+    def setUp(self):
+        class StoreMock(object):
+            def get(self, key):
+                return '["some", "other"]'
+
+            def get_many(self, keys):
+                return [self.get(key) for key in keys]
+
+            def cache_get(self, key):
+                return None
+
+            def cache_set(self, key, val, sec):
+                pass
+
+            def cache_get_many(self, keys):
+                return [None] * len(keys)
+
+            def cache_set_many(self, items, sec):
+                pass
+
+        self.handler_store = api.MainHTTPHandler.store
+        api.MainHTTPHandler.store = StoreMock()
+        self.start_server(workers=4)
+
+    def tearDown(self):
+        self.stop_server()
+        api.MainHTTPHandler.store = self.handler_store
+
+    def start_server(self, workers):
+        self.server = api.ThreadPoolHTTPServer(
+            ('localhost', 0), api.MainHTTPHandler, workers=workers)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, body):
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request('POST', '/method/', json.dumps(body))
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_metrics(self):
+        before = api.REQUESTS.get('online_score', '200')
+        body = {"account": "horns&hoofs", "login": "admin",
+                "method": "online_score",
+                "arguments": {"phone": "79175002040", "email": "a@b"}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        self.post(body)
+        self.assertEqual(api.REQUESTS.get('online_score', '200'), before + 1)
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request('GET', '/metrics')
+            response = conn.getresponse()
+            text = response.read().decode('utf-8')
+            self.assertEqual(response.status, api.OK)
+            self.assertTrue(
+                response.getheader('Content-Type').startswith('text/plain'))
+            self.assertIn('scoring_requests_total{method="online_score",'
+                          'code="200"} %s' % (before + 1), text)
+            self.assertIn('scoring_request_seconds_count{'
+                          'method="online_score"}', text)
+            conn.request('GET', '/other')
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, api.NOT_FOUND)
+        finally:
+            conn.close()
+
+    def test_profile_header(self):
+        self.addCleanup(setattr, api.MainHTTPHandler, 'profiler', None)
+        profiler = api.profiling.Profiler(token="secret")
+        api.MainHTTPHandler.profiler = profiler
+        body = {"account": "horns&hoofs", "login": "h&f",
+                "method": "clients_interests",
+                "arguments": {"client_ids": [1, 2]}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        self.post(body)
+        self.assertEqual(profiler.counts, {})
+        # sampling profiles requests but doesn't open the summary
+        profiler.rate = 1.0
+        self.post(body)
+        self.assertEqual(profiler.counts, {"clients_interests": 1})
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request('POST', '/method/', json.dumps(body),
+                         {"X-Profile": "secret"})
+            conn.getresponse().read()
+            self.assertEqual(profiler.counts, {"clients_interests": 2})
+            conn.request('GET', '/profile')
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, api.NOT_FOUND)
+            conn.request('GET', '/profile', headers={"X-Profile": "secret"})
+            response = conn.getresponse()
+            self.assertIn(b"get_interests_many", response.read())
+        finally:
+            conn.close()
+
+    def test_metrics_method_label(self):
+        before = api.REQUESTS.get('unknown', str(api.INVALID_REQUEST))
+        self.post({"account": "horns&hoofs", "login": "h&f",
+                   "method": "made up", "token": ""})
+        self.assertEqual(
+            api.REQUESTS.get('unknown', str(api.INVALID_REQUEST)), before + 1)
+
+    def test_keep_alive(self):
+        body = {"account": "horns&hoofs", "login": "admin",
+                "method": "online_score",
+                "arguments": {"phone": "79175002040", "email": "a@b"}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request('POST', '/method/', json.dumps(body))
+            response = conn.getresponse()
+            self.assertEqual(int(response.getheader('Content-Length')),
+                             len(response.read()))
+            sock = conn.sock
+            conn.request('POST', '/method/', json.dumps(body))
+            response = conn.getresponse()
+            self.assertEqual(json.loads(response.read())['response'],
+                             {'score': 42})
+            self.assertIs(conn.sock, sock)
+        finally:
+            conn.close()
+
+    def test_max_requests(self):
+        self.addCleanup(setattr, api.MainHTTPHandler, 'max_requests',
+                        api.MainHTTPHandler.max_requests)
+        api.MainHTTPHandler.max_requests = 2
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        self.addCleanup(conn.close)
+        headers = []
+        for _ in range(2):
+            conn.request('POST', '/method/', '{}')
+            response = conn.getresponse()
+            response.read()
+            headers.append(response.getheader('Connection'))
+        self.assertEqual(headers, [None, 'close'])
+        self.assertIsNone(conn.sock)
+
+    def test_body_log_sampling(self):
+        self.addCleanup(setattr, api.MainHTTPHandler, 'log_body_rate',
+                        api.MainHTTPHandler.log_body_rate)
+        for rate, expected in [(0, False), (1, True)]:
+            api.MainHTTPHandler.log_body_rate = rate
+            with self.assertLogs(level='INFO') as logs:
+                logging.info("start")
+                self.post({"login": "a"})
+            self.assertEqual(any('"login"' in line for line in logs.output),
+                             expected)
+
+    def test_empty_batch(self):
+        self.assertEqual(self.post([]), (api.OK, {"response": [],
+                                                  "code": api.OK}))
+
+    def test_idle_connection_holds_no_worker(self):
+        self.stop_server()
+        self.start_server(workers=1)
+        body = {"account": "horns&hoofs", "login": "h&f",
+                "method": "clients_interests",
+                "arguments": {"client_ids": [1]}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        idle = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            idle.request('POST', '/method/', json.dumps(body))
+            idle.getresponse().read()
+            started = time.monotonic()
+            self.assertEqual(self.post(body)[0], api.OK)
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            idle.close()
+
+    def test_concurrent_requests(self):
+        body = {"account": "horns&hoofs", "login": "h&f",
+                "method": "clients_interests",
+                "arguments": {"client_ids": [1, 2]}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        results = []
+
+        def worker():
+            results.append(self.post(body))
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 8)
+        for status, response in results:
+            self.assertEqual(status, api.OK)
+            self.assertEqual(len(response['response']), 2)
+
+
+class TestPrefork(unittest.TestCase):
+    """Runs run_prefork in a forked process and talks to its workers"""
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            self.address = sock.getsockname()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def run_server(self, store_factory):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                api.run_prefork(self.address, 2, store_factory,
+                                log_file=os.path.join(self.tmp.name, 'log'),
+                                restart_delay=0.1)
+            finally:
+                os._exit(0)
+
+        stopped = []
+
+        def stop():
+            if not stopped:
+                stopped.append(pid)
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+        self.addCleanup(stop)
+        return stop
+
+    def post(self, body, deadline=10):
+        started = time.monotonic()
+        while True:
+            conn = http.client.HTTPConnection(*self.address, timeout=5)
+            try:
+                conn.request('POST', '/method/', json.dumps(body))
+                response = conn.getresponse()
+                return response.status, json.loads(response.read())
+            except ConnectionRefusedError:
+                if time.monotonic() - started > deadline:
+                    raise
+                time.sleep(0.05)
+            finally:
+                conn.close()
+
+    def admin_score(self):
+        body = {"account": "horns&hoofs", "login": "admin",
+                "method": "online_score",
+                "arguments": {"phone": "79175002040", "email": "a@b"}}
+        body['token'] = api.digestize(api.MethodRequest(body))
+        return self.post(body)
+
+    def test_workers_serve_requests(self):
+        self.run_server(dict)
+        for _ in range(4):
+            self.assertEqual(self.admin_score(),
+                             (api.OK, {"code": api.OK,
+                                       "response": {"score": 42}}))
+
+    def test_failed_worker_is_restarted(self):
+        marker = os.path.join(self.tmp.name, 'failed')
+
+        def store_factory():
+            if not os.path.exists(marker):
+                open(marker, 'w').close()
+                raise RuntimeError("no store")
+            return {}
+        self.run_server(store_factory)
+        self.assertEqual(self.admin_score()[0], api.OK)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            with open(os.path.join(self.tmp.name, 'log')) as f:
+                log = f.read()
+            if log.count(' listening at ') == 2:
+                break
+            time.sleep(0.05)
+        self.assertIn("no store", log)
+        self.assertEqual(log.count(' listening at '), 2)
+
+    def test_profile_written_on_stop(self):
+        profile_dir = os.path.join(self.tmp.name, 'profile')
+        os.mkdir(profile_dir)
+        profiler = profiling.Profiler(rate=1.0, output_dir=profile_dir)
+        with mock.patch.object(api.MainHTTPHandler, 'profiler', profiler):
+            stop = self.run_server(dict)
+        self.assertEqual(self.admin_score()[0], api.OK)
+        stop()
+        self.assertTrue([name for name in os.listdir(profile_dir)
+                         if name.startswith('online_score.')])
+
+    def test_metrics_of_all_workers(self):
+        self.run_server(dict)
+        for _ in range(6):
+            self.assertEqual(self.admin_score()[0], api.OK)
+        expected = 'scoring_requests_total{method="online_score",code="200"} 6'
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            conn = http.client.HTTPConnection(*self.address, timeout=5)
+            conn.request('GET', '/metrics')
+            text = conn.getresponse().read().decode('utf-8')
+            conn.close()
+            if expected in text:
+                break
+            time.sleep(0.1)
+        self.assertIn(expected, text)
+
+
 if __name__ == '__main__':
     unittest.main()
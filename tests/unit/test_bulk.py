@@ -0,0 +1,130 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+import redis
+
+from scoring_api import api, bulk, scoring
+from tests.utils import cases
+
+
+class MemoryStore(object):
+    def __init__(self):
+        self.data = {"i:1": '["cars", "pets"]', "i:2": '["books"]'}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.get(key)
+
+    def cache_set(self, key, val, sec):
+        self.data[key] = val
+
+    def cache_get_many(self, keys):
+        return self.get_many(keys)
+
+    def cache_set_many(self, items, sec):
+        self.data.update(items)
+
+
+class FailingStore(MemoryStore):
+    """Fails cache reads of the score of the first test line"""
+    def cache_get_many(self, keys):
+        if scoring._score_key("79175002040", "a@b") in keys:
+            raise redis.ConnectionError("down")
+        return super().cache_get_many(keys)
+
+
+def request(login, method, arguments):
+    body = {"account": "horns&hoofs", "login": login, "method": method,
+            "arguments": arguments}
+    body["token"] = api.digestize(api.MethodRequest(body))
+    return body
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        interests = request("h&f", "clients_interests", {"client_ids": [1, 2]})
+        score = request("h&f", "online_score",
+                        {"phone": "79175002040", "email": "a@b"})
+        lines = [
+            json.dumps(score),
+            json.dumps(request("admin", "online_score",
+                               {"phone": "79175002040", "email": "a@b"})),
+            "",
+            json.dumps(interests),
+            "{broken",
+            "42",
+            json.dumps([interests, 1]),
+            json.dumps(dict(score, token="bad")),
+            json.dumps(request("h&f", "online_score", {"phone": "1"})),
+        ]
+        self.input = ("\n".join(lines) + "\n").encode('utf-8')
+        self.expected = [
+            {"response": {"score": 3.0}, "code": 200},
+            {"response": {"score": 42}, "code": 200},
+            {"response": {"1": ["cars", "pets"], "2": ["books"]},
+             "code": 200},
+            {"error": "Bad Request", "code": 400},
+            {"error": "Bad Request", "code": 400},
+            {"response": [{"response": {"1": ["cars", "pets"],
+                                        "2": ["books"]}, "code": 200},
+                          {"error": "Bad Request", "code": 400}],
+             "code": 200},
+            {"error": "Forbidden", "code": 403},
+            {"error": "invalid fields: phone", "code": 422,
+             "fields": {"phone": "length"}},
+        ]
+
+    def run_bulk(self, store_factory=MemoryStore, **kwargs):
+        output = io.BytesIO()
+        bulk.run(io.BytesIO(self.input), output, store_factory, **kwargs)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_in_process(self):
+        self.assertEqual(self.run_bulk(workers=0, chunk_size=3),
+                         self.expected)
+
+    def test_chunk_larger_than_batch(self):
+        with mock.patch.object(bulk, 'MAX_BATCH_SIZE', 2):
+            self.assertEqual(self.run_bulk(workers=0, chunk_size=100),
+                             self.expected)
+
+    def test_process_pool_keeps_order(self):
+        progress = io.StringIO()
+        results = self.run_bulk(workers=2, chunk_size=1, window=2,
+                                progress=bulk.Progress(progress))
+        self.assertEqual(results, self.expected)
+        self.assertIn("done: 8 requests", progress.getvalue())
+
+    @cases([0, 2])
+    def test_failed_chunk(self, workers):
+        # requests of the first chunk of 3 lines share one batch
+        results = self.run_bulk(FailingStore, workers=workers, chunk_size=3)
+        failed = {"error": "Internal Server Error", "code": 500}
+        self.assertEqual(results, [failed] * 3 + self.expected[3:])
+
+    def test_failed_chunk_in_process(self):
+        score_lines = bulk.score_lines
+
+        def fail_first(lines, store):
+            if lines[0] == self.input.splitlines(True)[0]:
+                raise RuntimeError("bug")
+            return score_lines(lines, store)
+        with mock.patch.object(bulk, 'score_lines', fail_first):
+            results = self.run_bulk(workers=0, chunk_size=3)
+        failed = {"error": "Internal Server Error", "code": 500}
+        self.assertEqual(results, [failed] * 3 + self.expected[3:])
+
+    def test_read_chunks(self):
+        chunks = list(bulk.read_chunks(io.BytesIO(b"1\n\n2\n3\n4"), 3))
+        self.assertEqual(chunks, [[b"1\n", b"2\n", b"3\n"], [b"4"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import json
+import unittest
+
+from scoring_api import codec
+from tests.utils import cases
+
+
+class TestCodec(unittest.TestCase):
+    @cases([
+        b'{"a": [1, 2.5, "b", null, true]}',
+        '{"a": {"b": "\\u0444"}}',
+        b'[]',
+    ])
+    def test_loads(self, data):
+        self.assertEqual(codec.loads(data), json.loads(data))
+
+    @cases([
+        {"response": {1: ["a", "b"], 2: []}, "code": 200},
+        {"error": "ф", "code": 422, "fields": {"__all__": "x"}},
+        {"big": 123456789012345678901234567890},
+        [1.5, None, True],
+    ])
+    def test_dumps(self, obj):
+        data = codec.dumps(obj)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(json.loads(data), json.loads(json.dumps(obj)))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            codec.loads(b'{"a": ')
+        with self.assertRaises(TypeError):
+            codec.dumps({"a": object()})
+
+    def test_std_backend(self):
+        self.assertEqual(codec.std_dumps({1: "a"}), b'{"1": "a"}')
+        self.assertEqual(codec.std_loads(b'{"1": "a"}'), {"1": "a"})
+
+
+if __name__ == '__main__':
+    unittest.main()
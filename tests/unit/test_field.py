@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 
 from scoring_api import field
 
@@ -155,5 +156,67 @@ class TestTypedField(unittest.TestCase):
             C.mixed_field.validate(c)
 
 
+class TestCompiledValidation(unittest.TestCase):
+    def test_plan_built_once(self):
+        calls = []
+
+        def validator(val):
+            calls.append(val)
+            return True
+
+        class F(field.RequiredField, field.NullableField, field.TypedField):
+            pass
+
+        class C(object):
+            f = F(required=True, nullable=False, type_=int,
+                  validators=[validator])
+        c = C()
+        c.f = 1
+        with mock.patch.object(F, '_steps',
+                               wraps=C.f._steps) as steps:
+            C.f.validate(c)
+            C.f.validate(c)
+        self.assertEqual(steps.call_count, 1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_compile(self):
+        class F(field.RequiredField, field.NullableField, field.TypedField):
+            pass
+
+        class C(object):
+            f = F(required=False, nullable=True, type_=str)
+        check = C.f.compile()
+        c = C()
+        self.assertIsNone(check(c))
+        c.f = ''
+        self.assertIsNone(check(c))
+        c.f = 5
+        self.assertEqual(check(c), 'type')
+        with self.assertRaises(TypeError):
+            C.f.validate(c)
+
+    def test_error_codes(self):
+        def validate_int(val):
+            if not isinstance(val, int):
+                raise TypeError("Must be int")
+            return True
+
+        class F(field.RequiredField, field.NullableField):
+            pass
+
+        class C(object):
+            f = F(required=True, nullable=False, validators=[validate_int])
+        c = C()
+        self.assertEqual(C.f.check(c), 'required')
+        c.f = None
+        self.assertEqual(C.f.check(c), 'null')
+        c.f = '5'
+        self.assertEqual(C.f.check(c), 'invalid')
+        with self.assertRaises(TypeError):
+            C.f.validate(c)
+        c.f = 5
+        self.assertIsNone(C.f.check(c))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+import json
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from scoring_api import interests
+from tests.utils import cases
+
+
+class TestCodec(unittest.TestCase):
+    @cases([
+        [],
+        ["cars", "pets"],
+        ["otus", "unknown", "cars"],
+        ["ф" * 200, "travel", ""],
+        list(interests.INTERESTS) * 3,
+    ])
+    def test_compact_round_trip(self, value):
+        data = interests.encode(value)
+        self.assertEqual(interests.detect(data), interests.COMPACT)
+        self.assertEqual(interests.decode(data), value)
+        self.assertLessEqual(len(data), len(json.dumps(value)))
+
+    def test_compact_is_small(self):
+        self.assertEqual(interests.encode(["cars", "tv", "otus"]),
+                         b"\x01\x00\x07\x0a")
+
+    @cases([
+        '["cars", "pets"]',
+        b'["cars", "pets"]',
+        b' ["cars"]',
+        b'[1, 2]',
+    ])
+    def test_json_detected(self, data):
+        self.assertEqual(interests.detect(data), interests.JSON)
+        self.assertEqual(interests.decode(data), json.loads(data))
+
+    @cases([None, b"", ""])
+    def test_empty(self, data):
+        self.assertEqual(interests.decode(data), [])
+
+    def test_not_strings_stay_json(self):
+        self.assertEqual(interests.encode([1, "cars"]), b'[1,"cars"]')
+
+    @cases([
+        b"\x01\x7f",
+        b"\x01\xff\x05ab",
+        b"\x01\xff\x80",
+    ])
+    def test_broken_compact(self, data):
+        with self.assertRaises(ValueError):
+            interests.decode(data)
+
+    def test_msgpack(self):
+        if interests.msgpack is None:
+            with self.assertRaises(ValueError):
+                interests.encode(["cars"], interests.MSGPACK)
+            with self.assertRaises(ValueError):
+                interests.decode(b"\x91\xa4cars")
+        else:
+            data = interests.encode(["cars"], interests.MSGPACK)
+            self.assertEqual(interests.detect(data), interests.MSGPACK)
+            self.assertEqual(interests.decode(data), ["cars"])
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis()
+        for cid in range(25):
+            self.client.set("i:%s" % cid, json.dumps(["cars", "c%s" % cid]))
+        self.client.expire("i:1", 100)
+        self.client.set("i:broken", b"\x01\x7f")
+        self.client.set("other", json.dumps(["cars"]))
+
+    def test_migrate(self):
+        result = interests.migrate(self.client, interests.COMPACT,
+                                   batch_size=10)
+        self.assertEqual(result, (26, 25, 0))
+        self.assertEqual(self.client.get("i:3"), b"\x01\x00\xff\x02c3")
+        self.assertEqual(interests.decode(self.client.get("i:3")),
+                         ["cars", "c3"])
+        self.assertGreater(self.client.ttl("i:1"), 0)
+        self.assertEqual(self.client.get("other"), b'["cars"]')
+        self.assertEqual(interests.migrate(self.client, interests.COMPACT),
+                         (26, 0, 0))
+        self.assertEqual(interests.migrate(self.client, interests.JSON),
+                         (26, 25, 1))
+        self.assertEqual(json.loads(self.client.get("i:3")), ["cars", "c3"])
+
+    def test_batch_retried_on_concurrent_write(self):
+        keys = [b"i:1", b"i:2"]
+        mget = self.client.pipeline().mget
+
+        def write_once(pipe_self, *args, **kwargs):
+            if not writes:
+                writes.append(1)
+                self.client.set("i:2", json.dumps(["pets"]))
+            return mget.__func__(pipe_self, *args, **kwargs)
+        writes = []
+        with mock.patch.object(type(self.client.pipeline()), 'mget',
+                               write_once):
+            self.assertEqual(interests.migrate_keys(
+                self.client, keys, interests.COMPACT), (2, 0))
+        self.assertEqual(interests.decode(self.client.get("i:2")), ["pets"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from scoring_api import metrics
+from tests.utils import cases
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        c = metrics.Counter('requests_total', 'Requests', ('method', 'code'))
+        c.inc('online_score', '200')
+        c.inc('online_score', '200', amount=2)
+        c.inc('batch', '422')
+        self.assertEqual(c.get('online_score', '200'), 3)
+        self.assertEqual(c.render().splitlines(), [
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{method="batch",code="422"} 1',
+            'requests_total{method="online_score",code="200"} 3',
+        ])
+
+    def test_histogram(self):
+        h = metrics.Histogram('latency_seconds', 'Latency', ('method',),
+                              buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            h.observe(value, 'm')
+        self.assertEqual(h.count('m'), 4)
+        self.assertEqual(h.render().splitlines()[2:], [
+            'latency_seconds_bucket{method="m",le="0.1"} 2',
+            'latency_seconds_bucket{method="m",le="1"} 3',
+            'latency_seconds_bucket{method="m",le="+Inf"} 4',
+            'latency_seconds_sum{method="m"} 3.65',
+            'latency_seconds_count{method="m"} 4',
+        ])
+
+    @cases([
+        ('a"b', 'a\\"b'),
+        ('a\\b', 'a\\\\b'),
+        ('a\nb', 'a\\nb'),
+    ])
+    def test_label_escaping(self, value, escaped):
+        c = metrics.Counter('c', 'C', ('label',))
+        c.inc(value)
+        self.assertIn('c{label="%s"} 1' % escaped, c.render())
+
+    def test_concurrent_updates(self):
+        c = metrics.Counter('c', 'C')
+
+        def inc():
+            for _ in range(1000):
+                c.inc()
+        threads = [threading.Thread(target=inc) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(c.get(), 8000)
+
+    def test_metric_is_abstract(self):
+        with self.assertRaises(TypeError):
+            metrics.Metric('m', 'M')
+
+    def test_registry(self):
+        registry = metrics.Registry()
+        registry.register(metrics.Gauge('g', 'G')).set(5)
+        registry.register(metrics.Counter('c', 'C')).inc()
+        text = registry.render()
+        self.assertTrue(text.endswith('\n'))
+        self.assertLess(text.index('g 5'), text.index('c 1'))
+
+
+class TestSharedMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.registry = metrics.Registry()
+        self.counter = self.registry.register(
+            metrics.Counter('c', 'C', ('method',)))
+        self.gauge = self.registry.register(metrics.Gauge('g', 'G'))
+        self.histogram = self.registry.register(
+            metrics.Histogram('h', 'H', buckets=(1,)))
+
+    def other_process(self, pid):
+        """Writes values of another process with pid to shared directory"""
+        other = metrics.Registry()
+        other.register(metrics.Counter('c', 'C', ('method',))).inc(
+            'm', amount=2)
+        other.register(metrics.Gauge('g', 'G')).set(7)
+        other.register(metrics.Histogram('h', 'H', buckets=(1,))).observe(
+            2.5)
+        other.path = os.path.join(self.tmp.name, '%s-1.json' % pid)
+        other.write()
+
+    def dead_pid(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def share(self):
+        self.counter.inc('m')
+        self.gauge.set(1)
+        self.histogram.observe(0.5)
+        self.registry.share(self.tmp.name, interval=60)
+
+    def test_values_are_summed(self):
+        self.share()
+        self.other_process(os.getppid())
+        text = self.registry.render()
+        self.assertIn('c{method="m"} 3', text)
+        self.assertIn('g{pid="%s"} 1' % os.getpid(), text)
+        self.assertIn('g{pid="%s"} 7' % os.getppid(), text)
+        self.assertIn('h_bucket{le="1"} 1', text)
+        self.assertIn('h_bucket{le="+Inf"} 2', text)
+        self.assertIn('h_sum 3', text)
+        self.assertIn('h_count 2', text)
+
+    def test_gauges_of_exited_process_dropped(self):
+        self.share()
+        pid = self.dead_pid()
+        self.other_process(pid)
+        text = self.registry.render()
+        self.assertIn('c{method="m"} 3', text)
+        self.assertNotIn('pid="%s"' % pid, text)
+
+    def test_written_values(self):
+        self.share()
+        self.counter.inc('m')
+        self.registry.write()
+        reader = metrics.Registry()
+        reader.register(metrics.Counter('c', 'C', ('method',)))
+        reader.path = os.path.join(self.tmp.name, 'reader.json')
+        self.assertIn('c{method="m"} 2', reader.render())
@@ -0,0 +1,84 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from scoring_api import profiling
+from tests.utils import cases
+
+
+def handler(request, ctx, store):
+    ctx['method'] = request['method']
+    return sum(range(100)), 200
+
+
+class TestProfiler(unittest.TestCase):
+    @cases([
+        (0.0, None, {}, False),
+        (1.0, None, {}, True),
+        (0.0, "secret", {"X-Profile": "secret"}, True),
+        (0.0, "secret", {"X-Profile": "wrong"}, False),
+        (0.0, None, {"X-Profile": "secret"}, False),
+    ])
+    def test_wanted(self, rate, token, headers, expected):
+        profiler = profiling.Profiler(rate=rate, token=token)
+        self.assertEqual(profiler.wanted(headers), expected)
+
+    @cases([
+        (1.0, None, {"X-Profile": "secret"}, False),
+        (1.0, "secret", {}, False),
+        (1.0, "secret", {"X-Profile": "wrong"}, False),
+        (0.0, "secret", {"X-Profile": "secret"}, True),
+    ])
+    def test_authorized(self, rate, token, headers, expected):
+        profiler = profiling.Profiler(rate=rate, token=token)
+        self.assertEqual(profiler.authorized(headers), expected)
+
+    def test_stats_per_method(self):
+        profiler = profiling.Profiler()
+        for method in ("online_score", "online_score", "clients_interests"):
+            self.assertEqual(profiler.call(handler, {"method": method}, {},
+                                           None), (4950, 200))
+        self.assertEqual(profiler.counts, {"online_score": 2,
+                                           "clients_interests": 1})
+        summary = profiler.summary("online_score")
+        self.assertIn("online_score: 2 requests", summary)
+        self.assertIn("handler", summary)
+        self.assertNotIn("clients_interests", summary)
+
+    def test_one_profile_at_a_time(self):
+        profiler = profiling.Profiler()
+
+        def nested(request, ctx, store):
+            return profiler.call(handler, request, ctx, store)
+        profiler.call(nested, {"method": "m"}, {}, None)
+        self.assertEqual(profiler.counts, {"m": 1})
+
+    def test_error_is_profiled(self):
+        profiler = profiling.Profiler()
+
+        def failing(request, ctx, store):
+            ctx['method'] = 'm'
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            profiler.call(failing, {}, {}, None)
+        self.assertEqual(profiler.counts, {"m": 1})
+        self.assertTrue(profiler.running.acquire(blocking=False))
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = profiling.Profiler(output_dir=output_dir, dump_every=2)
+            profiler.call(handler, {"method": "m"}, {}, None)
+            path = profiler.path("m")
+            self.assertFalse(os.path.exists(path))
+            profiler.call(handler, {"method": "m"}, {}, None)
+            self.assertTrue(os.path.exists(path))
+            os.remove(path)
+            profiler.dump()
+            self.assertEqual(pstats.Stats(path).total_calls,
+                             profiler.stats["m"].total_calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import json
+import threading
+import unittest
+
+from scoring_api import api, replay
+from tests.utils import cases
+
+
+class TestPercentile(unittest.TestCase):
+    @cases([
+        ([], 50, 0.0),
+        ([1], 99.9, 1),
+        ([1, 2, 3, 4], 50, 2),
+        ([1, 2, 3, 4], 90, 4),
+        (list(range(1, 1001)), 99.9, 999),
+        (list(range(1, 1001)), 99, 990),
+    ])
+    def test_percentile(self, values, q, expected):
+        self.assertEqual(replay.percentile(values, q), expected)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        class StoreMock(object):
+            def get(self, key):
+                return '["books"]'
+
+            def get_many(self, keys):
+                return [self.get(key) for key in keys]
+
+            def cache_get(self, key):
+                return None
+
+            def cache_set(self, key, val, sec):
+                pass
+
+            def cache_get_many(self, keys):
+                return [None] * len(keys)
+
+            def cache_set_many(self, items, sec):
+                pass
+
+        self.handler_store = api.MainHTTPHandler.store
+        api.MainHTTPHandler.store = StoreMock()
+        self.server = api.ThreadPoolHTTPServer(('localhost', 0),
+                                               api.MainHTTPHandler, workers=4)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        score = {"account": "horns&hoofs", "login": "h&f",
+                 "method": "online_score",
+                 "arguments": {"phone": "79175002040", "email": "a@b"}}
+        score["token"] = api.digestize(api.MethodRequest(score))
+        lines = [json.dumps(score), json.dumps(dict(score, token="bad")),
+                 "", json.dumps([score]), "{broken"]
+        self.requests = replay.load_requests(
+            io.BytesIO("\n".join(lines).encode('utf-8')))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        api.MainHTTPHandler.store = self.handler_store
+
+    def test_load_requests(self):
+        self.assertEqual([method for method, body in self.requests],
+                         ['online_score', 'online_score', 'batch', 'unknown'])
+
+    def test_concurrency(self):
+        report = replay.replay(self.server.server_address, self.requests,
+                               concurrency=3, total=40)
+        self.assertEqual(report["requests"], 40)
+        methods = report["methods"]
+        self.assertEqual(methods["online_score"]["codes"],
+                         {"200": 10, "403": 10})
+        self.assertEqual(methods["batch"]["codes"], {"200": 10})
+        self.assertEqual(methods["unknown"]["codes"], {"400": 10})
+        latency = methods["online_score"]["latency_ms"]
+        self.assertLessEqual(latency["50"], latency["99.9"])
+        self.assertIn("online_score", replay.format_report(report))
+
+    def test_rate(self):
+        report = replay.replay(self.server.server_address, self.requests,
+                               concurrency=2, rate=100, duration=0.2)
+        self.assertGreaterEqual(report["elapsed"], 0.19)
+        self.assertEqual(report["requests"], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
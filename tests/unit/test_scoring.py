@@ -1,7 +1,12 @@
+import asyncio
 import unittest
 import functools
+import threading
+import time
+from unittest import mock
 
 from scoring_api import scoring
+from scoring_api import store as store_module
 from tests.utils import cases
 
 
@@ -16,13 +21,25 @@ class TestGetScore(unittest.TestCase):
             def get(self, key):
                 return self.store.get(key, None)
 
+            def get_many(self, keys):
+                return [self.get(key) for key in keys]
+
             def cache_get(self, key):
                 return self.get(key)
 
             def cache_set(self, key, val, sec):
                 self.store[key] = val
 
+            def cache_get_many(self, keys):
+                self.calls.append('cache_get_many')
+                return [self.get(key) for key in keys]
+
+            def cache_set_many(self, items, sec):
+                self.calls.append('cache_set_many')
+                self.store.update(items)
+
         self.store = StoreMock()
+        self.store.calls = []
 
     @cases([
         (('phone', 'email', 'bday', 'g', 'f_name', 'l_name'), 5),
@@ -42,11 +59,202 @@ class TestGetScore(unittest.TestCase):
         self.store.cache_set(scoring._score_key(*args), None, 5)
         self.assertEqual(scoring.get_score(self.store, *args), 3)
 
+    @cases([
+        (('p', 'e1'), ('p', 'e2')),
+        (('p', 'e', 'b', 1), ('p', 'e', 'b', 2)),
+        (('p', 'e', None, None, 'ab', ''), ('p', 'e', None, None, 'a', 'b')),
+    ])
+    def test_score_key_uses_all_fields(self, args, other):
+        key = scoring._score_key(*args)
+        self.assertTrue(key.startswith('uid:v2:'))
+        self.assertNotEqual(key, scoring._score_key(*other))
+
+    @cases([
+        (('79175002040', 'e'), (79175002040, 'e')),
+        (('p', 'e', None, None), ('p', 'e', '', 0)),
+    ])
+    def test_score_key_normalized(self, args, other):
+        self.assertEqual(scoring._score_key(*args), scoring._score_key(*other))
+
+    def test_legacy_key_read_on_rollover(self):
+        args = ('phone1', 'email1')
+        key = scoring._score_key(*args)
+        self.store.cache_set(scoring._legacy_score_key(*args), -1, 5)
+        self.assertEqual(scoring.score_cache_keys(*args), [key])
+        self.assertEqual(scoring.get_score(self.store, *args), 3)
+        self.store.store.pop(key)
+        with mock.patch.object(scoring, 'READ_LEGACY_KEYS', True):
+            self.assertEqual(scoring.score_cache_keys(*args),
+                             [key, scoring._legacy_score_key(*args)])
+            self.assertEqual(scoring.get_score(self.store, *args), -1)
+        self.assertEqual(self.store.get(key), -1)
+
+    def test_get_scores_legacy_keys(self):
+        records = [{'phone': 'p1', 'email': 'e'}, {'phone': 'p2'}]
+        self.store.cache_set(scoring._legacy_score_key('p1', 'e'), -1, 5)
+        with mock.patch.object(scoring, 'READ_LEGACY_KEYS', True):
+            self.assertEqual(scoring.get_scores(self.store, records),
+                             [-1, 1.5])
+        self.assertEqual(self.store.calls, ['cache_get_many'] * 2 +
+                         ['cache_set_many'])
+        self.assertEqual(self.store.get(scoring._score_key('p1', 'e')), -1)
+
+    def test_get_scores(self):
+        records = [
+            dict(zip(scoring.SCORE_FIELDS,
+                     ('phone', 'email', 'bday', 1, 'f_name', 'l_name'))),
+            {'phone': 'phone', 'email': 'email', 'gender': 0},
+            {'birthday': 'bday', 'gender': 2},
+            {'phone': 'phone1', 'email': 'email1'},
+            {'phone': 'phone', 'email': 'email', 'gender': 0},
+        ]
+        self.store.cache_set(scoring._score_key('phone1', 'email1'), -1, 5)
+        scores = scoring.get_scores(self.store, records)
+        self.assertEqual(scores, [5, 3, 1.5, -1, 3])
+        self.assertEqual(self.store.calls,
+                         ['cache_get_many', 'cache_set_many'])
+        for record, score in zip(records[:3], scores):
+            row = scoring._record_values(record)
+            self.assertEqual(self.store.get(scoring._score_key(*row)), score)
+            self.assertEqual(scoring.get_score(self.store, *row), score)
+
+    def test_get_scores_all_cached(self):
+        records = [{'phone': 'phone', 'email': 'email'}]
+        self.assertEqual(scoring.get_scores(self.store, records), [3])
+        self.assertEqual(scoring.get_scores(self.store, records), [3])
+        self.assertEqual(self.store.calls, ['cache_get_many',
+                                            'cache_set_many',
+                                            'cache_get_many'])
+        self.assertEqual(scoring.get_scores(self.store, []), [])
+
     def test_clients_interests(self):
         cid = 42
         self.store.cache_set("i:%s" % cid, '["aa", "bb"]', 5)
         self.assertEqual(scoring.get_interests(self.store, cid), ['aa', 'bb'])
 
+    def test_clients_interests_many(self):
+        self.store.cache_set("i:1", '["aa", "bb"]', 5)
+        self.store.cache_set("i:3", '["cc"]', 5)
+        self.assertEqual(scoring.get_interests_many(self.store, [1, 2, 3]),
+                         [['aa', 'bb'], [], ['cc']])
+
+    def test_concurrent_lookups_coalesced(self):
+        self.store.cache_set("i:1", '["aa"]', 5)
+        get_many, calls = self.store.get_many, []
+
+        def slow_get_many(keys):
+            calls.append(keys)
+            time.sleep(0.05)
+            return get_many(keys)
+        self.store.get_many = slow_get_many
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            scoring.get_interests_many(self.store, [1, 2])))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[['aa'], []]] * 4)
+        self.assertEqual(calls, [['i:1', 'i:2']])
+        results[0][0].append('bb')
+        self.assertEqual(results[1][0], ['aa'])
+
+    def absent_cache(self, now):
+        cache = store_module.TTLCache(max_size=10, clock=lambda: now[0])
+        patches = [mock.patch.object(scoring, 'ABSENT_INTERESTS_TTL', 5),
+                   mock.patch.object(scoring, 'ABSENT_INTERESTS', cache)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return cache
+
+    def test_absent_interests_cached(self):
+        now = [0]
+        self.absent_cache(now)
+        self.store.cache_set("i:1", '["aa"]', 5)
+        self.assertEqual(scoring.get_interests_many(self.store, [1, 2]),
+                         [['aa'], []])
+        self.store.cache_set("i:2", '["bb"]', 5)
+        with mock.patch.object(self.store, 'get_many',
+                               wraps=self.store.get_many) as get_many:
+            self.assertEqual(scoring.get_interests_many(self.store, [1, 2]),
+                             [['aa'], []])
+            get_many.assert_called_once_with(['i:1'])
+        self.assertEqual(scoring.get_interests(self.store, 2), [])
+        self.assertEqual(scoring.unknown_interests_keys(['i:1', 'i:2']),
+                         ['i:1'])
+        now[0] = 5
+        self.assertEqual(scoring.get_interests(self.store, 2), ['bb'])
+
+    def test_absent_interests_forgotten(self):
+        now = [0]
+        cache = self.absent_cache(now)
+        self.assertEqual(scoring.get_interests(self.store, 3), [])
+        self.assertEqual(len(cache), 1)
+        self.store.cache_set("i:3", '["cc"]', 5)
+        scoring.forget_absent_interests([3])
+        self.assertEqual(scoring.get_interests(self.store, 3), ['cc'])
+        self.assertEqual(len(cache), 0)
+
+    def test_absent_interests_disabled(self):
+        self.assertEqual(scoring.get_interests(self.store, 4), [])
+        self.store.cache_set("i:4", '["dd"]', 5)
+        self.assertEqual(scoring.get_interests(self.store, 4), ['dd'])
+
+    def test_async_variants(self):
+        class AsyncStore(object):
+            def __init__(self, store):
+                self.store = store
+
+            async def get(self, key):
+                return self.store.get(key)
+
+            async def get_many(self, keys):
+                return self.store.get_many(keys)
+
+            async def cache_get(self, key):
+                return self.store.cache_get(key)
+
+            async def cache_set(self, key, val, sec):
+                self.store.cache_set(key, val, sec)
+
+            async def cache_get_many(self, keys):
+                return self.store.cache_get_many(keys)
+
+            async def cache_set_many(self, items, sec):
+                self.store.cache_set_many(items, sec)
+
+        async_store = AsyncStore(self.store)
+        self.store.cache_set("i:1", '["aa"]', 5)
+        score = asyncio.run(scoring.get_score_async(async_store, 'p', 'e'))
+        self.assertEqual(score, 3)
+        self.assertEqual(self.store.get(scoring._score_key('p', 'e')), 3)
+        interests = asyncio.run(scoring.get_interests_async(async_store, 1))
+        self.assertEqual(interests, ['aa'])
+        interests = asyncio.run(
+            scoring.get_interests_many_async(async_store, [1, 2]))
+        self.assertEqual(interests, [['aa'], []])
+        self.absent_cache([0])
+        asyncio.run(scoring.get_interests_many_async(async_store, [1, 2]))
+        self.store.cache_set("i:2", '["bb"]', 5)
+        self.assertEqual(asyncio.run(
+            scoring.get_interests_async(async_store, 2)), [])
+        self.assertEqual(asyncio.run(
+            scoring.get_interests_many_async(async_store, [1, 2])),
+            [['aa'], []])
+        self.store.cache_set(scoring._legacy_score_key('p3', 'e'), -1, 5)
+        with mock.patch.object(scoring, 'READ_LEGACY_KEYS', True):
+            score = asyncio.run(scoring.get_score_async(async_store, 'p3',
+                                                        'e'))
+            self.assertEqual(score, -1)
+            scores = asyncio.run(scoring.get_scores_async(
+                async_store, [{'phone': 'p4', 'email': 'e'}]))
+            self.assertEqual(scores, [3])
+        scores = asyncio.run(scoring.get_scores_async(
+            async_store, [{'phone': 'p', 'email': 'e'}, {'phone': 'p2'}]))
+        self.assertEqual(scores, [3, 1.5])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
+import asyncio
 import unittest
 import time
 import threading
+from unittest import mock
 
 import fakeredis
 
@@ -23,6 +25,37 @@ class TestStore(unittest.TestCase):
         self.redis_mock.set('name1', 'val1')
         self.assertEqual(self.store.get('name1'), b'val1')
 
+    def test_get_many(self):
+        self.redis_mock.set('name1', 'val1')
+        self.redis_mock.set('name3', 'val3')
+        self.assertEqual(self.store.get_many(['name1', 'name2', 'name3']),
+                         [b'val1', None, b'val3'])
+        self.assertEqual(self.store.get_many([]), [])
+
+    def test_get_many_chunks(self):
+        keys = ['name%s' % i for i in range(10)]
+        for key in keys[::2]:
+            self.redis_mock.set(key, key)
+        self.store.chunk_size = 3
+        with mock.patch.object(self.redis_mock, 'mget',
+                               wraps=self.redis_mock.mget) as mget:
+            values = self.store.get_many(keys)
+        self.assertEqual(mget.call_count, 4)
+        self.assertEqual(values, [key.encode() if i % 2 == 0 else None
+                                  for i, key in enumerate(keys)])
+
+    def test_cache_many(self):
+        self.store.cache_set_many({'name1': 'val1', 'name2': 'val2'}, 60)
+        self.assertEqual(self.store.cache_get_many(['name1', 'x', 'name2']),
+                         [b'val1', None, b'val2'])
+        self.assertTrue(0 < self.redis_mock.ttl('name2') <= 60)
+
+    def test_cache_many_failed_conn(self):
+        self.server.connected = False
+        self.store.cache_set_many({'name1': 'val1'}, 60)
+        self.assertEqual(self.store.cache_get_many(['name1', 'x']),
+                         [None, None])
+
     def test_cached_get(self):
         self.assertIsNone(self.store.cache_get('some'))
 
@@ -54,6 +87,9 @@ class TestStore(unittest.TestCase):
         self.assertIsNone(self.store.cache_get('bla'))
 
     def test_reconnect(self):
+        self.store = store.RedisStore(
+            attempts=2, timeout=1, client_builder=lambda: self.redis_mock,
+            retry_backoff=0.3)
         self.server.connected = False
 
         def restore_connection():
@@ -65,5 +101,560 @@ class TestStore(unittest.TestCase):
         self.assertIsNone(self.store.get('bla'))
         t.join()
 
+    def test_no_ping_per_command(self):
+        with mock.patch.object(self.redis_mock, 'ping',
+                               side_effect=AssertionError('ping')):
+            self.store.cache_set('name1', 'val1', 60)
+            self.assertEqual(self.store.get('name1'), b'val1')
+            self.assertEqual(self.store.cache_get('name1'), b'val1')
+
+    def test_reconnect_after_failure_only(self):
+        builder = mock.Mock(return_value=self.redis_mock)
+        s = store.RedisStore(attempts=2, timeout=1, client_builder=builder)
+        s.get('name1')
+        self.assertEqual(builder.call_count, 1)
+        self.server.connected = False
+        with self.assertRaises(store.redis.ConnectionError):
+            s.get('name1')
+        self.assertEqual(builder.call_count, 3)
+
+    def test_cache_operations_not_retried(self):
+        builder = mock.Mock(return_value=self.redis_mock)
+        s = store.RedisStore(attempts=2, timeout=1, client_builder=builder)
+        self.server.connected = False
+        self.assertIsNone(s.cache_get('name1'))
+        s.cache_set('name1', 1, 60)
+        self.assertEqual(s.cache_get_many(['name1']), [None])
+        s.cache_set_many({'name1': 1}, 60)
+        self.assertEqual(builder.call_count, 1)
+        self.assertEqual(s.breaker.failures, 4)
+
+    def test_metrics(self):
+        s = store.RedisStore(attempts=2, timeout=1,
+                             client_builder=lambda: self.redis_mock)
+        reconnects = store.REDIS_RECONNECTS.get()
+        errors = store.REDIS_ERRORS.get('get')
+        observed = store.REDIS_LATENCY.count('get')
+        s.get('name1')
+        self.assertEqual(store.REDIS_LATENCY.count('get'), observed + 1)
+        self.server.connected = False
+        with self.assertRaises(store.redis.ConnectionError):
+            s.get('name1')
+        self.assertEqual(store.REDIS_RECONNECTS.get(), reconnects + 2)
+        self.assertEqual(store.REDIS_ERRORS.get('get'), errors + 3)
+        self.assertEqual(store.REDIS_LATENCY.count('get'), observed + 4)
+
+    def test_breaker_fails_fast(self):
+        breaker = store.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        s = store.RedisStore(attempts=5, timeout=1, breaker=breaker,
+                             client_builder=lambda: self.redis_mock)
+        self.server.connected = False
+        rejected = store.REDIS_REJECTED.get('get')
+        with self.assertRaises(store.redis.ConnectionError):
+            s.get('name1')
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertEqual(store.REDIS_REJECTED.get('get'), rejected + 1)
+        self.server.connected = True
+        with mock.patch.object(self.redis_mock, 'get') as get:
+            self.assertIsNone(s.cache_get('name1'))
+            s.cache_set('name1', 'val1', 60)
+            self.assertEqual(s.cache_get_many(['name1']), [None])
+        get.assert_not_called()
+        self.assertIsNone(self.redis_mock.get('name1'))
+
+    def test_breaker_probe_closes(self):
+        breaker = store.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        s = store.RedisStore(attempts=0, timeout=1, breaker=breaker,
+                             client_builder=lambda: self.redis_mock)
+        self.server.connected = False
+        self.assertIsNone(s.cache_get('name1'))
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.server.connected = True
+        s.cache_set('name1', 'val1', 60)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(s.get('name1'), b'val1')
+
+    def test_pool_settings(self):
+        s = store.RedisStore(pool_size=7, timeout=2, connect_timeout=1,
+                             keepalive=False, health_check_interval=10)
+        kwargs = s.pool.connection_kwargs
+        self.assertEqual(s.pool.max_connections, 7)
+        self.assertEqual(kwargs['socket_timeout'], 2)
+        self.assertEqual(kwargs['socket_connect_timeout'], 1)
+        self.assertFalse(kwargs['socket_keepalive'])
+        self.assertEqual(kwargs['health_check_interval'], 10)
+        self.assertIs(s.client.connection_pool, s.pool)
+
+
+def start_tcp_server(test):
+    """Starts fakeredis server on a free port, returns its address"""
+    server = fakeredis.TcpFakeServer(('localhost', 0), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server.server_address
+
+
+class TestPooledStore(unittest.TestCase):
+    def setUp(self):
+        self.host, self.port = start_tcp_server(self)
+
+    def test_more_threads_than_connections(self):
+        s = store.RedisStore(host=self.host, port=self.port, pool_size=2)
+        self.addCleanup(s.pool.disconnect)
+        s.cache_set('name1', 'val1', 60)
+        errors, results = [], []
+
+        def get():
+            for _ in range(50):
+                try:
+                    results.append(s.get('name1'))
+                except Exception as e:
+                    errors.append(e)
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [b'val1'] * 400)
+        self.assertEqual(s.breaker.failures, 0)
+        self.assertLessEqual(len(s.pool._connections), 2)
+
+    def test_exhausted_pool_is_not_redis_failure(self):
+        s = store.RedisStore(host=self.host, port=self.port, pool_size=1,
+                             timeout=1)
+        self.addCleanup(s.pool.disconnect)
+        connection = s.pool.get_connection()
+        with mock.patch.object(s, '_reconnect') as reconnect:
+            with self.assertRaises(store.redis.MaxConnectionsError):
+                s.get('name1')
+            self.assertIsNone(s.cache_get('name1'))
+        reconnect.assert_not_called()
+        self.assertEqual(s.breaker.failures, 0)
+        s.pool.release(connection)
+        self.assertIsNone(s.get('name1'))
+
+
+class TestAsyncPooledStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.host, self.port = start_tcp_server(self)
+
+    async def test_more_tasks_than_connections(self):
+        s = store.AsyncRedisStore(host=self.host, port=self.port,
+                                  pool_size=2)
+        await s.cache_set('name1', 'val1', 60)
+        results = await asyncio.gather(*[s.get('name1') for _ in range(40)])
+        self.assertEqual(results, [b'val1'] * 40)
+        self.assertEqual(s.breaker.failures, 0)
+        await s.pool.disconnect()
+
+    async def test_exhausted_pool_is_not_redis_failure(self):
+        s = store.AsyncRedisStore(host=self.host, port=self.port,
+                                  pool_size=1, timeout=1)
+        connection = await s.pool.get_connection()
+        with self.assertRaises(store.redis.MaxConnectionsError):
+            await s.get('name1')
+        self.assertEqual(s.breaker.failures, 0)
+        await s.pool.release(connection)
+        self.assertIsNone(await s.get('name1'))
+        await s.pool.disconnect()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.changes = []
+        self.breaker = store.CircuitBreaker(failure_threshold=3,
+                                            reset_timeout=1,
+                                            clock=lambda: self.now)
+        self.breaker.add_listener(
+            lambda old, state: self.changes.append((old, state)))
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.failure()
+        self.breaker.success()
+        for _ in range(2):
+            self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.changes, [('closed', 'open')])
+
+    def test_half_open_lets_one_probe(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.now = 0.5
+        self.assertFalse(self.breaker.allow())
+        self.now = 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, self.breaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+        self.now = 2
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.changes, [('closed', 'open'),
+                                        ('open', 'half_open'),
+                                        ('half_open', 'open'),
+                                        ('open', 'half_open'),
+                                        ('half_open', 'closed')])
+
+    def test_lost_probe_is_replaced(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.now = 1
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.now = 2
+        self.assertTrue(self.breaker.allow())
+
+    def test_metrics_listener(self):
+        store.report_breaker_state('closed', 'open')
+        self.assertEqual(store.BREAKER_STATE.get(), 1)
+        store.report_breaker_state('open', 'half_open')
+        self.assertEqual(store.BREAKER_STATE.get(), 2)
+        store.report_breaker_state('half_open', 'closed')
+        self.assertEqual(store.BREAKER_STATE.get(), 0)
+
+
+class TestPrefetchedStore(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis_mock = fakeredis.FakeStrictRedis(server=self.server)
+        self.redis_mock.set('i:1', 'stored')
+        self.backend = store.RedisStore(client_builder=lambda: self.redis_mock)
+        self.store = store.PrefetchedStore(self.backend, {'i:2': b'pre'},
+                                           {'uid:1': b'1.5'})
+
+    def test_reads(self):
+        self.assertEqual(self.store.get('i:2'), b'pre')
+        self.assertEqual(self.store.get_many(['i:1', 'i:2', 'i:3']),
+                         [b'stored', b'pre', None])
+        self.assertEqual(self.store.cache_get('uid:1'), b'1.5')
+        self.assertIsNone(self.store.cache_get('uid:2'))
+
+    def test_buffered_writes(self):
+        self.store.cache_set('uid:2', 3, 60)
+        self.store.cache_set('uid:3', 4, 30)
+        self.assertEqual(self.store.cache_get('uid:2'), 3)
+        self.assertIsNone(self.redis_mock.get('uid:2'))
+        self.store.flush()
+        self.assertEqual(self.redis_mock.get('uid:2'), b'3')
+        self.assertTrue(0 < self.redis_mock.ttl('uid:3') <= 30)
+        self.assertEqual(self.store.pending, {})
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = store.TTLCache(max_size=2, clock=lambda: self.now)
+
+    def test_expiration(self):
+        self.cache.set('a', 1, 10)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1, 10)
+        self.cache.set('b', 2, 10)
+        self.cache.get('a')
+        self.cache.set('c', 3, 10)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_non_positive_ttl(self):
+        self.cache.set('a', 1, 10)
+        self.cache.set('a', 2, 0)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_pop(self):
+        self.cache.set('a', 1, 10)
+        self.assertEqual(self.cache.pop('a'), 1)
+        self.assertIsNone(self.cache.pop('a'))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flights = store.SingleFlight('test')
+        self.calls = []
+        self.release = threading.Event()
+
+    def slow(self, keys):
+        self.calls.append(list(keys))
+        self.release.wait(5)
+        return [key * 2 for key in keys]
+
+    def run_threads(self, target, n):
+        results = [None] * n
+
+        def run(i):
+            try:
+                results[i] = target()
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        while len(self.flights.flights) == 0 or not self.calls:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one(self):
+        results = self.run_threads(
+            lambda: self.flights.do(3, lambda: self.slow([3])[0]), 5)
+        self.assertEqual(results, [6] * 5)
+        self.assertEqual(self.calls, [[3]])
+        self.assertEqual(self.flights.flights, {})
+
+    def test_error_propagates_to_waiters(self):
+        def fail():
+            self.release.wait(5)
+            raise ValueError('boom')
+        self.calls.append('fail')
+        results = self.run_threads(lambda: self.flights.do(1, fail), 3)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(self.flights.do(1, lambda: 'ok'), 'ok')
+
+    def test_many_identical_keys(self):
+        results = self.run_threads(
+            lambda: self.flights.do_many([1, 2], self.slow), 3)
+        self.assertEqual(results, [[2, 4]] * 3)
+        self.assertEqual(self.calls, [[1, 2]])
+        results[0].append(0)
+        self.assertEqual(results[1], [2, 4])
+
+    def test_many_overlapping_keys(self):
+        first = threading.Thread(
+            target=lambda: self.flights.do_many([1, 2], self.slow))
+        first.start()
+        while not self.calls:
+            time.sleep(0.001)
+        results = self.run_threads(
+            lambda: self.flights.do_many([2, 3, 1, 3], self.slow), 1)
+        first.join()
+        self.assertEqual(results, [[4, 6, 2, 6]])
+        self.assertEqual(self.calls, [[1, 2], [3]])
+        self.assertEqual(self.flights.flights, {})
+
+    def test_many_joins_single_key_call(self):
+        first = threading.Thread(
+            target=lambda: self.flights.do(2, lambda: self.slow([2])[0]))
+        first.start()
+        while not self.calls:
+            time.sleep(0.001)
+        shared = store.SINGLEFLIGHT_SHARED.get('test')
+        results = self.run_threads(
+            lambda: self.flights.do_many([1, 2], self.slow), 1)
+        first.join()
+        self.assertEqual(results, [[2, 4]])
+        self.assertEqual(self.calls, [[2], [1]])
+        self.assertEqual(store.SINGLEFLIGHT_SHARED.get('test'), shared + 1)
+
+    def test_many_error_of_joined_call(self):
+        def fail(keys):
+            self.calls.append(keys)
+            self.release.wait(5)
+            raise ValueError('boom')
+        first = threading.Thread(
+            target=lambda: self.assertRaises(
+                ValueError, self.flights.do_many, [1], fail))
+        first.start()
+        while not self.calls:
+            time.sleep(0.001)
+        results = self.run_threads(
+            lambda: self.flights.do_many([1, 2], self.slow), 1)
+        first.join()
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(self.flights.flights, {})
+
+    def test_scopes_not_shared(self):
+        results = self.run_threads(
+            lambda: self.flights.do(3, lambda: self.slow([3])[0],
+                                    threading.current_thread().name), 2)
+        self.assertEqual(results, [6, 6])
+        self.assertEqual(self.calls, [[3], [3]])
+        self.assertEqual(self.flights.flights, {})
+
+    def test_sequential_calls_not_cached(self):
+        self.assertEqual(self.flights.do(1, lambda: 'a'), 'a')
+        self.assertEqual(self.flights.do(1, lambda: 'b'), 'b')
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flights = store.AsyncSingleFlight('test')
+        self.calls = []
+
+    async def slow(self, keys):
+        self.calls.append(list(keys))
+        await asyncio.sleep(0.01)
+        return [key * 2 for key in keys]
+
+    async def test_concurrent_calls_share_one(self):
+        async def one():
+            return (await self.slow([3]))[0]
+        results = await asyncio.gather(
+            *[self.flights.do(3, one) for _ in range(5)])
+        self.assertEqual(results, [6] * 5)
+        self.assertEqual(self.calls, [[3]])
+        self.assertEqual(self.flights.flights, {})
+
+    async def test_many_overlapping_keys(self):
+        results = await asyncio.gather(
+            self.flights.do_many([1, 2], self.slow),
+            self.flights.do_many([1, 2], self.slow),
+            self.flights.do_many([2, 3, 1], self.slow))
+        self.assertEqual(results, [[2, 4], [2, 4], [4, 6, 2]])
+        self.assertEqual(self.calls, [[1, 2], [3]])
+        self.assertEqual(self.flights.flights, {})
+
+    async def test_error_propagates_to_waiters(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+        results = await asyncio.gather(
+            *[self.flights.do(1, fail) for _ in range(3)],
+            return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(self.flights.flights, {})
+
+    async def test_cancelled_leader(self):
+        leader = asyncio.ensure_future(self.flights.do_many([1], self.slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(self.flights.do_many([1], self.slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(await self.flights.do_many([1], self.slow), [2])
+
+
+class TestCachingStore(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis_mock = fakeredis.FakeStrictRedis(server=self.server)
+        self.backend = store.RedisStore(client_builder=lambda: self.redis_mock)
+        self.store = store.CachingStore(self.backend, max_size=2)
+
+    def test_hot_keys_stay_in_process(self):
+        self.store.cache_set('uid:1', 1.5, 60)
+        self.assertEqual(self.redis_mock.get('uid:1'), b'1.5')
+        with mock.patch.object(self.backend, 'cache_get') as cache_get:
+            self.assertEqual(self.store.cache_get('uid:1'), 1.5)
+            self.assertFalse(cache_get.called)
+        self.assertEqual(self.store.stats()['hits'], 1)
+
+    def test_read_through(self):
+        self.redis_mock.set('uid:1', '3.0')
+        self.assertEqual(self.store.cache_get('uid:1'), b'3.0')
+        self.redis_mock.delete('uid:1')
+        self.assertEqual(self.store.cache_get('uid:1'), b'3.0')
+        self.assertIsNone(self.store.cache_get('uid:2'))
+        self.assertEqual(self.store.stats()['misses'], 2)
+
+    def test_ttl_from_cache_set(self):
+        self.store.cache.clock = lambda: 0
+        self.store.cache_set('uid:1', 1.5, 5)
+        self.store.cache.clock = lambda: 5
+        self.redis_mock.delete('uid:1')
+        self.assertIsNone(self.store.cache_get('uid:1'))
+
+    def test_many(self):
+        self.store.cache_set_many({'uid:1': 1, 'uid:2': 2}, 60)
+        self.redis_mock.set('uid:3', '3')
+        self.assertEqual(self.store.cache_get_many(['uid:1', 'uid:3', 'x']),
+                         [1, b'3', None])
+
+    def test_get_passed_through(self):
+        self.redis_mock.set('i:1', 'val')
+        self.assertEqual(self.store.get('i:1'), b'val')
+        self.assertEqual(self.store.get_many(['i:1']), [b'val'])
+        self.assertEqual(len(self.store.cache), 0)
+
+
+class TestAsyncStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis_mock = fakeredis.FakeAsyncRedis(server=self.server)
+        self.store = store.AsyncRedisStore(
+            attempts=2, timeout=1, client_builder=lambda: self.redis_mock
+        )
+
+    async def test_get_missed_key(self):
+        self.assertIsNone(await self.store.get('some'))
+
+    async def test_get_stored_key(self):
+        await self.redis_mock.set('name1', 'val1')
+        self.assertEqual(await self.store.get('name1'), b'val1')
+
+    async def test_get_many(self):
+        await self.redis_mock.set('name1', 'val1')
+        self.store.chunk_size = 1
+        self.assertEqual(await self.store.get_many(['name1', 'name2']),
+                         [b'val1', None])
+
+    async def test_cache_many(self):
+        await self.store.cache_set_many({'name1': 'val1'}, 60)
+        self.assertEqual(await self.store.cache_get_many(['name1', 'x']),
+                         [b'val1', None])
+
+    async def test_cached_set(self):
+        await self.store.cache_set('name1', 'val1', 60)
+        self.assertEqual(await self.store.cache_get('name1'), b'val1')
+
+    async def test_cache_get_failed_conn(self):
+        self.server.connected = False
+        self.assertIsNone(await self.store.cache_get('bla'))
+
+    async def test_get_failed_conn(self):
+        self.server.connected = False
+        with self.assertRaises(Exception):
+            await self.store.get('bla')
+
+    async def test_cache_operations_not_retried(self):
+        self.server.connected = False
+        with mock.patch.object(self.store, '_reconnect') as reconnect:
+            self.assertIsNone(await self.store.cache_get('bla'))
+            await self.store.cache_set('bla', 1, 60)
+            self.assertEqual(await self.store.cache_get_many(['bla']),
+                             [None])
+            await self.store.cache_set_many({'bla': 1}, 60)
+        reconnect.assert_not_called()
+
+    async def test_breaker_fails_fast(self):
+        self.store.breaker = store.CircuitBreaker(failure_threshold=1,
+                                                  reset_timeout=60)
+        self.server.connected = False
+        self.assertIsNone(await self.store.cache_get('bla'))
+        self.server.connected = True
+        self.assertIsNone(await self.store.cache_get('bla'))
+        self.assertEqual(self.store.breaker.state, store.CircuitBreaker.OPEN)
+
+
+    async def test_pool_settings(self):
+        for pool_size, pool_cls in [
+                (None, store.redis.asyncio.ConnectionPool),
+                (7, store.redis.asyncio.BlockingConnectionPool)]:
+            s = store.AsyncRedisStore(pool_size=pool_size, timeout=2,
+                                      connect_timeout=1)
+            self.assertIsInstance(s.pool, pool_cls)
+            self.assertEqual(s.pool.connection_kwargs['socket_timeout'], 2)
+            self.assertIsInstance(s.client, store.redis.asyncio.Redis)
+            self.assertIs(s.client.connection_pool, s.pool)
+
 if __name__ == '__main__':
     unittest.main()
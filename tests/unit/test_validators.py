@@ -0,0 +1,77 @@
+import datetime
+import unittest
+
+from dateutil.relativedelta import relativedelta
+
+from scoring_api import validators
+from tests.utils import cases
+
+
+def strptime_date(val, fmt):
+    try:
+        return datetime.datetime.strptime(val, fmt).date()
+    except (ValueError, TypeError):
+        return None
+
+
+class TestParseDate(unittest.TestCase):
+    @cases([
+        '14.04.1989',
+        '29.02.2000',
+        '29.02.2001',
+        '31.04.2000',
+        '00.01.2000',
+        '1.1.2000',
+        '01.01.2000 ',
+        '01.01.20O0',
+        '01-01-2000',
+        '+1.01.2000',
+        '١١.01.2000',
+        '',
+        None,
+        20000101,
+    ])
+    def test_same_as_strptime(self, val):
+        self.assertEqual(validators._parse_date(val, '%d.%m.%Y'),
+                         strptime_date(val, '%d.%m.%Y'))
+
+    @cases([
+        ('2000-01-31', '%Y-%m-%d'),
+        ('31.01.2000', '%Y-%m-%d'),
+    ])
+    def test_other_formats(self, val, fmt):
+        self.assertEqual(validators._parse_date(val, fmt),
+                         strptime_date(val, fmt))
+
+
+class TestAgeCheck(unittest.TestCase):
+    @cases([
+        datetime.date(2024, 2, 29),
+        datetime.date(2024, 2, 28),
+        datetime.date(2023, 3, 1),
+        datetime.date(2025, 12, 31),
+    ])
+    def test_same_as_relativedelta(self, today):
+        now = datetime.datetime.combine(today, datetime.time(12)).timestamp()
+        check = validators.is_age_le(70, '%d.%m.%Y', clock=lambda: now).check
+        start = datetime.date(today.year - 72, 1, 1)
+        for days in range(3 * 366):
+            bday = start + datetime.timedelta(days=days)
+            expected = ('age' if relativedelta(today, bday).years > 70
+                        else None)
+            self.assertEqual(check(bday.strftime('%d.%m.%Y')), expected,
+                             bday)
+
+    def test_cutoff_follows_day(self):
+        midnight = datetime.datetime(2001, 1, 1).timestamp()
+        now = [midnight - 1]
+        check = validators.is_age_le(1, '%d.%m.%Y',
+                                     clock=lambda: now[0]).check
+        self.assertIsNone(check('01.01.1999'))
+        now[0] = midnight
+        self.assertEqual(check('01.01.1999'), 'age')
+        self.assertEqual(check('1999-01-01'), 'date')
+
+
+if __name__ == '__main__':
+    unittest.main()